@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+'''
+benchmarks.bench_sync.py
+
+Sync benchmarks against a local Redmine stand-in and a SQLite ELSAEvent database.
+Times fetching event issues, writing them with update_event_database and expanding event templates
+for some installation sizes and reports throughput, HTTP requests, SQL statements and peak memory.
+
+Needs the usual localsettings modules, the Redmine site and database from there are not used.
+
+Usage: python benchmarks/bench_sync.py [--sizes 1000 10000 100000] [--latency 0.02] [--orm] [--json FILE]
+'''
+import argparse
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+import gc
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.append(".")
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from eventsync.redmine import httpcache
+from eventsync.redmine.metacache import metadata_cache
+from eventsync.redmine.redmineapi import BaseRedmineResource, Issue
+from eventsync.redmine.issues import get_event_issues, TemplateExpansion, occurrence_dates
+from eventsync.elsaevent.datamodel import DeclarativeBase, User, Status, Category, Group
+from eventsync.elsaevent.localsettings import ELSA_REDMINE_USERNAME, ELSA_DEFAULT_CATEGORY
+from eventsync.fingerprints import FingerprintStore
+import eventsync.redmine_elsa_sync as redmine_elsa_sync
+
+from benchmarks.redmine_standin import RedmineStandIn, CATEGORIES
+
+BenchResult = namedtuple("BenchResult", "phase size seconds items requests statements peak_mb")
+
+
+class StatementCounter(object):
+    """Counts SQL statements executed by an engine, executemany counts once."""
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def make_elsa_database(path, project_ids):
+    """Create the ELSAEvent schema with the rows the sync needs, one group per project.
+    Returns (engine, project mappings).
+    """
+    engine = create_engine("sqlite:///" + path)
+    DeclarativeBase.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(User(id=1, group_id=1, password="x", real_name="Redmine", role="user", timezone="Europe/Berlin",
+                     username=ELSA_REDMINE_USERNAME))
+    for status_id, name in enumerate(["Neu", "Bestätigt", "Abgesagt"], 1):
+        session.add(Status(id=status_id, name=name))
+    for category_id, name in enumerate(sorted(set(CATEGORIES + [ELSA_DEFAULT_CATEGORY])), 1):
+        session.add(Category(id=category_id, name=name))
+    project_mappings = {}
+    for group_id, project_id in enumerate(project_ids, 1):
+        session.add(Group(id=group_id, homepage="", kurzalias="g{}".format(group_id), name="Gruppe {}".format(group_id),
+                          wikipage=""))
+        project_mappings[project_id] = group_id
+    session.commit()
+    session.close()
+    return engine, project_mappings
+
+
+def make_templates(count):
+    """Weekly event templates for the year 2030, with different weekdays."""
+    templates = []
+    for n in range(count):
+        start_date = date(2030, 1, 1) + timedelta(days=n % 7)
+        templates.append(Issue(dict(
+            id=900000 + n, subject="Stammtisch $ort am $datum", description="Um $startzeit in $ort.",
+            project=dict(id=100, name="Projekt"), start_date=start_date.isoformat(), due_date="2030-12-31",
+            custom_fields=[dict(id=10, name="Wiederholungsart", value="Jede Woche"),
+                           dict(id=11, name="Terminart", value="Termin"),
+                           dict(id=2, name="Startzeit", value="19:00"),
+                           dict(id=4, name="Ort", value="Gaststätte {}".format(n))])))
+    return templates
+
+
+def measure(phase, size, func, standin, counter, trace_memory=True):
+    """Run `func`, which returns the number of processed items, and collect the numbers."""
+    gc.collect()
+    standin.reset_counter()
+    statements_before = counter.count
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    items = func()
+    seconds = time.perf_counter() - started
+    peak_mb = None
+    if trace_memory:
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+    result = BenchResult(phase, size, seconds, items, standin.requests, counter.count - statements_before, peak_mb)
+    print_result(result)
+    return result
+
+
+def print_result(result):
+    throughput = result.items / result.seconds if result.seconds else 0
+    peak = "{:8.1f}".format(result.peak_mb) if result.peak_mb is not None else "       -"
+    print("{:<40} {:>7} {:>8.2f}s {:>10.0f}/s {:>8} req {:>8} sql {} MB".format(
+        result.phase, result.size, result.seconds, throughput, result.requests, result.statements, peak))
+
+
+def bench_size(size, args, workdir):
+    results = []
+    standin = RedmineStandIn(size, projects=args.projects, latency=args.latency,
+                             description_size=args.description_size).start()
+    try:
+        BaseRedmineResource.site = standin.url
+        metadata_cache.invalidate()
+        project_ids = [standin.project_id(n) for n in range(args.projects)]
+        modes = [("bulk", True)] + ([("orm", False)] if args.orm else [])
+        issues = []
+
+        def fetch():
+            issues[:] = get_event_issues(True, records=True)
+            return len(issues)
+
+        for mode, bulk in modes:
+            db_path = os.path.join(workdir, "elsa-{}-{}.db".format(size, mode))
+            engine, project_mappings = make_elsa_database(db_path, project_ids)
+            counter = StatementCounter(engine)
+            if not issues:
+                results.append(measure("get_event_issues", size, fetch, standin, counter, args.memory))
+            ctx = redmine_elsa_sync.SyncContext(sessionmaker(bind=engine)(), project_mappings,
+                                                FingerprintStore(os.path.join(workdir, "fp-{}-{}".format(size, mode))))
+            last_update_dt = datetime(2000, 1, 1)
+            for phase in ("insert", "unchanged"):
+                results.append(measure("update_event_database ({}, {})".format(mode, phase), size,
+                                       lambda: redmine_elsa_sync.update_event_database(
+                                           issues, last_update_dt, context=ctx, bulk=bulk) and len(issues),
+                                       standin, counter, args.memory))
+            ctx.session.close()
+            engine.dispose()
+
+        templates = make_templates(max(1, size // 52))
+        occurrence_dates.cache_clear()
+
+        def expand():
+            return sum(len(TemplateExpansion(t).payloads()) for t in templates)
+        results.append(measure("template expansion", size, expand, standin, counter, args.memory))
+    finally:
+        standin.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Redmine -> ELSAEvent sync.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="numbers of issues")
+    parser.add_argument("--projects", type=int, default=20, help="number of Redmine projects")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every HTTP response")
+    parser.add_argument("--description-size", type=int, default=200, help="length of issue descriptions")
+    parser.add_argument("--orm", action="store_true", help="also benchmark writing without bulk statements")
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="don't trace memory, tracing slows down the benchmarks")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    # benchmark the plain transport, without conditional requests
+    httpcache.HTTP_CACHE_FILENAME = None
+    metadata_cache.filename = None
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            results.extend(bench_size(size, args, workdir))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([r._asdict() for r in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
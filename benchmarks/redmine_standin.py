@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+'''
+benchmarks.redmine_standin.py
+
+Local stand-in for the Redmine REST API (JSON only) serving synthetic event issues,
+trackers, issue statuses and projects, for benchmarks of the sync.
+Issues are generated on the fly from their id, so large installations don't need much memory.
+Supports offset/limit pagination, the tracker_id and issue_id filters and issue creation by POST.
+
+Run standalone: python benchmarks/redmine_standin.py [NUMBER_OF_ISSUES] [PORT]
+'''
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import json
+import sys
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+TRACKERS = [{"id": 1, "name": "Termin"}, {"id": 2, "name": "Termin extern"}, {"id": 3, "name": "Terminvorlage"}]
+ISSUE_STATUSES = [{"id": 1, "name": "Neu"}, {"id": 2, "name": "Bestätigt"}, {"id": 5, "name": "Abgeschlossen"},
+                  {"id": 6, "name": "Abgesagt"}]
+CATEGORIES = ["Stammtisch", "Infostand", "Vortrag", "Sonstiges"]
+# Redmine caps the page size at 100
+MAX_LIMIT = 100
+
+
+class RedmineStandIn(object):
+    """Synthetic Redmine server.
+
+    :param issues: number of event issues
+    :param projects: number of projects, issue n belongs to project n % projects
+    :param latency: seconds added to every response
+    :param description_size: length of the issue descriptions in characters
+    """
+    def __init__(self, issues=1000, projects=20, latency=0.0, description_size=200, host="127.0.0.1", port=0):
+        self.issues = issues
+        self.projects = projects
+        self.latency = latency
+        self.description = ("Lorem ipsum dolor sit amet. " * (description_size // 28 + 1))[:description_size]
+        self.requests = 0
+        self.created = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counter(self):
+        with self._lock:
+            self.requests = 0
+
+    def project_id(self, n):
+        return 100 + n
+
+    def issue(self, issue_id):
+        project_id = self.project_id(issue_id % self.projects)
+        day = 1 + issue_id % 28
+        return {
+            "id": issue_id,
+            "project": {"id": project_id, "name": "Projekt {}".format(project_id)},
+            "tracker": {"id": 1 + issue_id % 2, "name": TRACKERS[issue_id % 2]["name"]},
+            "status": {"id": 2, "name": "Bestätigt"},
+            "subject": "Termin {}".format(issue_id),
+            "description": self.description,
+            "start_date": "2030-{:02d}-{:02d}".format(1 + issue_id % 12, day),
+            "due_date": "2030-{:02d}-{:02d}".format(1 + issue_id % 12, day),
+            "custom_fields": [
+                {"id": 2, "name": "Startzeit", "value": "19:00"},
+                {"id": 3, "name": "Ende", "value": "23:00"},
+                {"id": 4, "name": "Veranstaltungsort", "value": "Gaststätte {}".format(issue_id % 50)},
+                {"id": 6, "name": "Adresse", "value": "Hauptstraße {}".format(issue_id % 100)},
+                {"id": 5, "name": "Kategorien", "multiple": True, "value": [CATEGORIES[issue_id % 4]]},
+            ],
+            "created_on": "2029-01-01T10:00:00Z",
+            "updated_on": "2029-{:02d}-{:02d}T10:00:00Z".format(1 + issue_id % 12, day),
+        }
+
+    def _collection(self, name, query):
+        """(items, total_count) for a collection request, total_count is None for unpaginated collections."""
+        offset = int(query.get("offset", 0))
+        limit = min(int(query.get("limit", 25)), MAX_LIMIT)
+        if name == "issues":
+            if "issue_id" in query:
+                ids = sorted(int(i) for i in query["issue_id"].split(",") if 0 < int(i) <= self.issues)
+            else:
+                ids = range(1, self.issues + 1)
+            if "tracker_id" in query:
+                trackers = {int(t) for t in query["tracker_id"].split("|")}
+                ids = [i for i in ids if 1 + i % 2 in trackers] if len(trackers) < 2 else ids
+            return [self.issue(i) for i in ids[offset:offset + limit]], len(ids)
+        if name == "projects":
+            projects = [{"id": self.project_id(n), "identifier": "projekt{}".format(n), "name": "Projekt {}".format(n)}
+                        for n in range(self.projects)]
+            return projects[offset:offset + limit], len(projects)
+        if name == "trackers":
+            return TRACKERS, None
+        if name == "issue_statuses":
+            return ISSUE_STATUSES, None
+        return None, None
+
+    def _make_handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, content=None):
+                body = json.dumps(content).encode("utf-8") if content is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _count(self):
+                with standin._lock:
+                    standin.requests += 1
+                if standin.latency:
+                    time.sleep(standin.latency)
+
+            def do_GET(self):
+                self._count()
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                name = url.path.strip("/").rsplit(".", 1)[0]
+                if name.startswith("issues/"):
+                    issue_id = int(name.split("/")[1])
+                    if not 0 < issue_id <= standin.issues:
+                        return self._send(404)
+                    return self._send(200, {"issue": standin.issue(issue_id)})
+                items, total_count = standin._collection(name, query)
+                if items is None:
+                    return self._send(404)
+                content = {name: items}
+                if total_count is not None:
+                    content.update(total_count=total_count, offset=int(query.get("offset", 0)),
+                                   limit=min(int(query.get("limit", 25)), MAX_LIMIT))
+                self._send(200, content)
+
+            def do_POST(self):
+                self._count()
+                length = int(self.headers.get("Content-Length", 0))
+                attributes = json.loads(self.rfile.read(length).decode("utf-8"))["issue"]
+                with standin._lock:
+                    issue_id = standin.issues + len(standin.created) + 1
+                    standin.created.append(attributes)
+                self._send(201, {"issue": dict(attributes, id=issue_id)})
+
+        return Handler
+
+
+if __name__ == "__main__":
+    issues = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8765
+    standin = RedmineStandIn(issues, port=port)
+    print("serving {} issues on {}".format(issues, standin.url))
+    standin._server.serve_forever()
@@ -3,12 +3,45 @@
 elsaevent
 Created on 15.03.2013
 @author: escaP
+
+Engine and session are created on first use, importing this package doesn't touch the database.
 '''
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from .datamodel import DeclarativeBase
 from .localsettings import ELSA_SQLALCHEMY_CONNECTION_STR
+from eventsync.metrics import metrics
+
+_engine = None
+_session = None
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        _engine = create_engine(ELSA_SQLALCHEMY_CONNECTION_STR)
+        metrics.instrument_engine(_engine)
+        DeclarativeBase.metadata.bind = _engine
+    return _engine
+
+
+def get_session():
+    """Shared session for ELSAEvent"""
+    global _session
+    if _session is None:
+        _session = new_session()
+    return _session
+
+
+def new_session():
+    """Separate session for ELSAEvent, for example for a worker thread."""
+    return sessionmaker(bind=get_engine())()
+
 
-engine = create_engine(ELSA_SQLALCHEMY_CONNECTION_STR)
-DeclarativeBase.metadata.bind = engine
-session = sessionmaker(bind=engine)()
+def __getattr__(name):
+    # old module attributes, kept for scripts using eventsync.elsaevent.session
+    if name == "engine":
+        return get_engine()
+    if name == "session":
+        return get_session()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
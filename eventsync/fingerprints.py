@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+'''
+eventsync.fingerprints.py
+
+Content fingerprints of synced events, stored locally per event url.
+An event whose mapped values and categories didn't change since the last write can be skipped,
+for example when only a journal note was added to the Redmine issue.
+The store also keeps the update time of the issue which was synced last to the event,
+the reconcile uses it to find outdated events.
+'''
+from datetime import datetime
+import hashlib
+import sqlite3
+import threading
+
+FINGERPRINTS_FILENAME = "eventsync.fingerprints"
+
+
+def event_fingerprint(values, categories):
+    """Hash of the column values and the category set of an event."""
+    h = hashlib.sha1()
+    for key in sorted(values):
+        h.update("{}={!r}\n".format(key, values[key]).encode("utf-8"))
+    h.update(",".join(str(category_id) for category_id in sorted(c.id for c in categories)).encode("utf-8"))
+    return h.hexdigest()
+
+
+class FingerprintStore(object):
+    """url -> fingerprint mapping in a SQLite file.
+
+    :param filename: database file, ":memory:" for a store which lives only as long as the process.
+    """
+    def __init__(self, filename=FINGERPRINTS_FILENAME):
+        self.filename = filename
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.filename, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS fingerprints (url TEXT PRIMARY KEY, fingerprint TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS versions (url TEXT PRIMARY KEY, updated_on TEXT)")
+        return self._db
+
+    def get(self, url):
+        with self._lock:
+            row = self._open().execute("SELECT fingerprint FROM fingerprints WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else None
+
+    def update(self, fingerprints):
+        """Store fingerprints from a dict url -> fingerprint."""
+        with self._lock:
+            db = self._open()
+            db.executemany("INSERT OR REPLACE INTO fingerprints VALUES (?, ?)", fingerprints.items())
+            db.commit()
+
+    def update_versions(self, versions):
+        """Store the synced issue versions from a dict url -> issue updated_on."""
+        with self._lock:
+            db = self._open()
+            db.executemany("INSERT OR REPLACE INTO versions VALUES (?, ?)", 
+                           ((url, updated_on.isoformat()) for url, updated_on in versions.items()))
+            db.commit()
+
+    def versions(self):
+        """dict url -> updated_on of the issue which was synced last to the event."""
+        with self._lock:
+            rows = self._open().execute("SELECT url, updated_on FROM versions").fetchall()
+        return {url: datetime.fromisoformat(updated_on) for url, updated_on in rows}
+
+    def clear(self):
+        with self._lock:
+            db = self._open()
+            db.execute("DELETE FROM fingerprints")
+            db.execute("DELETE FROM versions")
+            db.commit()
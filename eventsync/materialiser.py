@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+'''
+eventsync.materialiser.py
+
+Idempotent materialisation of event templates (tracker Terminvorlage).
+Only occurrences within a rolling horizon are created. Created occurrences are recorded
+as (template id, occurrence date) -> issue id in the sync state store, so every run creates
+just the occurrences which came into the horizon since the last run and the job can run every cycle.
+'''
+from datetime import date, timedelta
+import logging
+
+from .redmine.issues import get_event_templates, TemplateExpansion
+from .redmine.bulkcreate import create_issues
+
+logg = logging.getLogger(__name__)
+
+# days from today for which template occurrences are created
+TEMPLATE_HORIZON_DAYS = 90
+
+
+def pending_occurrences(state, issue_templates, start, end):
+    """(key, issue attributes) for all occurrences in [start, end] which weren't created yet.
+    Keys are (template id, occurrence date).
+    Invalid templates, for example with missing custom fields or an unknown tracker, are skipped.
+    """
+    items = []
+    for issue_template in issue_templates:
+        try:
+            expansion = TemplateExpansion(issue_template)
+            payloads = expansion.payloads(start, end)
+        except (ValueError, KeyError, AttributeError, LookupError) as e:
+            logg.warn("skipping invalid event template #%s: %s", issue_template.id, e)
+            continue
+        done = state.template_occurrences(expansion.template_id, start, end)
+        items.extend(((expansion.template_id, occurrence_date), payload) 
+                     for occurrence_date, payload in payloads if occurrence_date not in done)
+    return items
+
+
+def materialise_templates(state, issue_templates=None, horizon_days=TEMPLATE_HORIZON_DAYS, today=None, **kwargs):
+    """Create the missing issues for template occurrences from `today` until `horizon_days` days later.
+    Occurrences which already exist in Redmine are recorded without creating them again,
+    failed ones are retried by the next run.
+    
+    :param state: SyncStateStore which records the created occurrences.
+    :param issue_templates: event templates, all templates are fetched if None.
+    :param kwargs: passed to :func:`eventsync.redmine.bulkcreate.create_issues`
+    :returns: list of CreateResult for the occurrences which were pending.
+    """
+    start = today or date.today()
+    end = start + timedelta(days=horizon_days)
+    if issue_templates is None:
+        issue_templates = get_event_templates()
+    items = pending_occurrences(state, issue_templates, start, end)
+    if not items:
+        logg.debug("no new template occurrences until %s", end)
+        return []
+    logg.info("materialising %s template occurrences until %s", len(items), end)
+    results = create_issues(items, **kwargs)
+    state.record_template_occurrences([result.key + (result.issue_id,) 
+                                       for result in results if result.status != "failed"])
+    return results
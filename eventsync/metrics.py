@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+'''
+eventsync.metrics.py
+
+Cheap in-process instrumentation: counters and per-phase timers (HTTP, parsing, mapping, flush, commit).
+Values are cumulative for the process, a per-run summary is the difference of two snapshots.
+They can be exported in the Prometheus text format, as file for the node exporter or by the webhook listener.
+'''
+from contextlib import contextmanager
+from functools import wraps
+import logging
+import os
+import threading
+import time
+
+logg = logging.getLogger(__name__)
+
+METRICS_PREFIX = "eventsync"
+
+
+class Metrics(object):
+    """Thread-safe counters and phase timers."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        # phase -> [seconds, calls]
+        self._timers = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def add_time(self, phase, seconds):
+        with self._lock:
+            timer = self._timers.get(phase)
+            if timer is None:
+                timer = self._timers[phase] = [0.0, 0]
+            timer[0] += seconds
+            timer[1] += 1
+
+    @contextmanager
+    def timer(self, phase):
+        """Measure the time spent in the with block as `phase`."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - started)
+
+    def timed(self, phase):
+        """Decorator version of :meth:`timer`."""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(phase):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def instrument_engine(self, engine):
+        """Count SQL statements executed by a SQLAlchemy engine."""
+        from sqlalchemy import event
+        event.listen(engine, "before_cursor_execute", lambda *args: self.incr("db_statements"))
+
+    def snapshot(self):
+        """Current values as {"counters": {name: value}, "timers": {phase: {"seconds": s, "calls": n}}}"""
+        with self._lock:
+            return {"counters": dict(self._counters),
+                    "timers": {phase: {"seconds": seconds, "calls": calls}
+                               for phase, (seconds, calls) in self._timers.items()}}
+
+    def summary_since(self, snapshot):
+        """Values accumulated since `snapshot` was taken, same structure as :meth:`snapshot`."""
+        current = self.snapshot()
+        counters = {name: value - snapshot["counters"].get(name, 0) for name, value in current["counters"].items()}
+        timers = {}
+        for phase, timer in current["timers"].items():
+            before = snapshot["timers"].get(phase, {"seconds": 0.0, "calls": 0})
+            timers[phase] = {"seconds": round(timer["seconds"] - before["seconds"], 6),
+                             "calls": timer["calls"] - before["calls"]}
+        return {"counters": {k: v for k, v in counters.items() if v},
+                "timers": {k: v for k, v in timers.items() if v["calls"]}}
+
+    def prometheus_text(self):
+        """All values in the Prometheus text exposition format."""
+        current = self.snapshot()
+        lines = []
+        for name, value in sorted(current["counters"].items()):
+            metric = "{}_{}_total".format(METRICS_PREFIX, name)
+            lines.append("# TYPE {} counter".format(metric))
+            lines.append("{} {}".format(metric, value))
+        for suffix, key in (("seconds", "seconds"), ("calls", "calls")):
+            metric = "{}_phase_{}_total".format(METRICS_PREFIX, suffix)
+            lines.append("# TYPE {} counter".format(metric))
+            for phase, timer in sorted(current["timers"].items()):
+                lines.append('{}{{phase="{}"}} {}'.format(metric, phase, timer[key]))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, filename):
+        """Write :meth:`prometheus_text` atomically to `filename`, for the node exporter textfile collector."""
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_filename, filename)
+
+
+metrics = Metrics()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+'''
+eventsync.redmine.bulkcreate.py
+
+Create many issues at once, for example the occurrences of event templates.
+Issues are posted by a bounded thread pool with a request rate limit, using the pooled keep-alive connection.
+Retries of rate limited requests (429) are done by the transport; other failed POSTs are not retried
+because the server could have created the issue already.
+Occurrences which already exist (same project, subject and start date) are skipped with the help of
+an index fetched with one paginated listing.
+'''
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import json
+import logging
+import threading
+import time
+
+from pyactiveresource import connection
+
+from .redmineapi import Issue
+from .issues import TemplateExpansion, get_event_issues_by_start_date
+from .localsettings import REDMINE_DATE_FORMAT
+
+logg = logging.getLogger(__name__)
+
+# number of parallel POST requests
+BULK_CREATE_WORKERS = 4
+# max. number of POST requests per second, None for no limit
+BULK_CREATE_RATE = 5.0
+
+# result for one issue, status is "created", "exists" or "failed"
+CreateResult = namedtuple("CreateResult", "key status issue_id error")
+
+
+class RateLimiter(object):
+    """Spaces calls to :meth:`wait` at least 1 / `rate` seconds apart, across threads."""
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _existing_key(project_id, subject, start_date):
+    return project_id, subject, start_date
+
+
+def _issue_key(attributes, prefix_options=None):
+    return _existing_key((attributes.get("project") or {}).get("id"), attributes.get("subject"),
+                         attributes.get("start_date")), attributes.get("id")
+
+
+def fetch_existing_index(start_date, due_date):
+    """dict (project id, subject, start date string) -> issue id of all event issues starting in 
+    [start_date, due_date], fetched with a single paginated listing.
+    """
+    return dict(get_event_issues_by_start_date(start_date, due_date, build=_issue_key))
+
+
+def post_issue(payload):
+    """Create an issue from a dict of attributes, returns the new issue id.
+    Raises connection.ResourceInvalid if the server rejects the issue.
+    """
+    body = json.dumps({"issue": payload}).encode("utf-8")
+    response = Issue.connection.post(Issue._collection_path(), Issue.headers, data=body)
+    return Issue.format.decode(response.body).get("id")
+
+
+def _error_messages(err):
+    try:
+        return "; ".join(json.loads(err.response.body.decode("utf-8"))["errors"])
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return str(err)
+
+
+def create_issues(items, existing=None, workers=BULK_CREATE_WORKERS, rate=BULK_CREATE_RATE):
+    """Create issues concurrently.
+
+    :param items: iterable of (key, issue attributes), the key identifies the issue in the results.
+        Only the first item for a key is created, later ones are dropped.
+    :param existing: index from :func:`fetch_existing_index`, issues found there are skipped.
+        Fetched for the date range of the items if None.
+    :param workers: number of parallel requests.
+    :param rate: max. requests per second, None for no limit.
+    :returns: list of CreateResult in the order of the first item for every key.
+    """
+    unique = {}
+    for key, payload in items:
+        if key in unique:
+            logg.warn("dropping duplicate item %s", key)
+        else:
+            unique[key] = payload
+    items = list(unique.items())
+    if not items:
+        return []
+    if existing is None:
+        dates = [datetime.strptime(payload["start_date"], REDMINE_DATE_FORMAT) for _, payload in items]
+        existing = fetch_existing_index(min(dates), max(dates))
+    limiter = RateLimiter(rate)
+
+    def create(item):
+        key, payload = item
+        existing_id = existing.get(_existing_key(payload["project_id"], payload["subject"], payload["start_date"]))
+        if existing_id is not None:
+            return CreateResult(key, "exists", existing_id, None)
+        limiter.wait()
+        try:
+            issue_id = post_issue(payload)
+        except connection.ResourceInvalid as err:
+            logg.warn("issue %s rejected: %s", key, _error_messages(err))
+            return CreateResult(key, "failed", None, _error_messages(err))
+        except connection.Error as err:
+            logg.warn("creating issue %s failed: %s", key, err)
+            return CreateResult(key, "failed", None, str(err))
+        return CreateResult(key, "created", issue_id, None)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(create, items))
+    counts = {}
+    for result in results:
+        counts[result.status] = counts.get(result.status, 0) + 1
+    logg.info("bulk create of %s issues: %s", len(results), counts)
+    return results
+
+
+def create_issues_from_templates(issue_templates, start=None, end=None, **kwargs):
+    """Expand event templates for [start, end] and create the occurrences which don't exist yet.
+    Keys of the results are (template id, occurrence date).
+    Other keyword arguments are passed to :func:`create_issues`.
+    """
+    items = []
+    for issue_template in issue_templates:
+        expansion = TemplateExpansion(issue_template)
+        items.extend(((expansion.template_id, date), payload) for date, payload in expansion.payloads(start, end))
+    return create_issues(items, **kwargs)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+'''
+eventsync.redmine.formats.py
+
+Resource formats for the Redmine REST API.
+'''
+import json
+import logging
+
+from pyactiveresource import formats
+
+logg = logging.getLogger(__name__)
+
+# pagination info which Redmine adds next to the root element of collections
+PAGINATION_KEYS = ("total_count", "offset", "limit")
+
+
+def _remove_root(data):
+    if isinstance(data, dict):
+        data = {k: v for k, v in data.items() if k not in PAGINATION_KEYS}
+        if len(data) == 1:
+            return next(iter(data.values()))
+    return data
+
+
+class RedmineJSONFormat(formats.JSONFormat):
+    """JSON format which understands Redmine collections like
+    {"issues": [...], "total_count": 120, "offset": 0, "limit": 60}.
+    The generic JSON format only removes the root element if it is the only key.
+    """
+
+    @staticmethod
+    def decode_collection(resource_string):
+        """Decode a collection response.
+        
+        :returns: (list of element dicts, total_count or None)
+        """
+        try:
+            data = json.loads(resource_string)
+        except ValueError as err:
+            raise formats.Error(err)
+        total_count = data.get("total_count") if isinstance(data, dict) else None
+        return _remove_root(data), total_count
+
+    @staticmethod
+    def decode(resource_string):
+        """Convert a resource string to a dictionary (single element) or list (collection)."""
+        return RedmineJSONFormat.decode_collection(resource_string)[0]
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+'''
+eventsync.redmine.httpcache.py
+
+Local cache of Redmine GET responses for conditional requests.
+Responses with an ETag or Last-Modified header are stored per request; the next request for
+the same URL sends If-None-Match / If-Modified-Since and the cached body is used on 304 Not Modified.
+'''
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logg = logging.getLogger(__name__)
+
+HTTP_CACHE_FILENAME = "eventsync.httpcache"
+# entries not used for this many seconds are removed when the cache is opened
+HTTP_CACHE_MAX_AGE = 7 * 24 * 3600
+
+
+class ResponseCache(object):
+    """SQLite backed store for (ETag, Last-Modified, headers, body) per request key.
+
+    :param filename: database file, ":memory:" for a cache which lives only as long as the process.
+    :param max_age: remove entries which haven't been used for `max_age` seconds.
+    """
+    def __init__(self, filename=HTTP_CACHE_FILENAME, max_age=HTTP_CACHE_MAX_AGE):
+        self.filename = filename
+        self.max_age = max_age
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.filename, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses ("
+                             "key TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, "
+                             "headers TEXT, body BLOB, used REAL)")
+            self._db.execute("DELETE FROM responses WHERE used < ?", (time.time() - self.max_age,))
+            self._db.commit()
+        return self._db
+
+    def get(self, key):
+        """Returns (etag, last_modified, headers, body) for `key` or None."""
+        with self._lock:
+            row = self._open().execute("SELECT etag, last_modified, headers, body FROM responses WHERE key = ?",
+                                       (key,)).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, headers, body = row
+        return etag, last_modified, json.loads(headers), bytes(body)
+
+    def put(self, key, etag, last_modified, headers, body):
+        with self._lock:
+            db = self._open()
+            db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                       (key, etag, last_modified, json.dumps(headers), sqlite3.Binary(body), time.time()))
+            db.commit()
+
+    def touch(self, key):
+        """Mark entry as used, called when a cached body was served."""
+        with self._lock:
+            db = self._open()
+            db.execute("UPDATE responses SET used = ? WHERE key = ?", (time.time(), key))
+            db.commit()
+
+    def clear(self):
+        with self._lock:
+            db = self._open()
+            db.execute("DELETE FROM responses")
+            db.commit()
@@ -6,20 +6,32 @@ Created on 18.03.2013
 
 Issue handling on the side of Redmine, building upon the basic redmine API.
 '''
+from datetime import datetime, time
+from functools import lru_cache
 import logging
 import string
-from .redmineapi import Issue, Tracker, IssueStatus
-from eventsync.redmine.resourceaddons import custom_fields
+from .redmineapi import Issue
+from .metacache import metadata_cache
+from .records import IssueRecord, issue_stamp
+from eventsync.redmine.resourceaddons import custom_fields, iter_all
 from dateutil.rrule import rrule, WEEKLY, MONTHLY, DAILY
-from eventsync.redmine.localsettings import READABLE_DATE_FORMAT, READABLE_TIME_FORMAT
+from eventsync.redmine.localsettings import READABLE_DATE_FORMAT, READABLE_TIME_FORMAT, REDMINE_DATE_FORMAT
 
 logg = logging.getLogger(__name__)
 
 
-# maybe find a better way to cache these API objects
-tracker_termin = Tracker.find_first_by_name("Termin")
-tracker_termin_ext = Tracker.find_first_by_name("Termin extern")
-tracker_template = Tracker.find_first_by_name("Terminvorlage")
+# tracker ids are resolved on first use, importing this module doesn't access the server
+TRACKER_TERMIN = "Termin"
+TRACKER_TERMIN_EXT = "Termin extern"
+TRACKER_TEMPLATE = "Terminvorlage"
+# issues with these statuses are not published as events
+UNSYNCED_STATUSES = ("Abgeschlossen", "Neu")
+# number of ids in one issue_id filter, keeps the URL short
+ISSUE_ID_BATCH_SIZE = 100
+# custom fields of event templates which are not copied to the created issues
+TEMPLATE_ONLY_FIELDS = ("intervall", "wiederholungsart", "terminart")
+# value of the custom field "Terminart" of a template -> tracker of the created issues
+TERMINART_TRACKERS = {"Termin": TRACKER_TERMIN, "Termin extern": TRACKER_TERMIN_EXT}
     
 def _make_time_constraint(start_dt=None, end_dt=None):
     start_timestr = start_dt.strftime("%Y-%m-%d") if start_dt else "1970-01-01"
@@ -32,30 +44,94 @@ def _make_time_constraint(start_dt=None, end_dt=None):
         return None
 
 
-def get_event_issues(fetch_closed=False, start_dt=None, end_dt=None):
+def _event_tracker_filter():
+    """Redmine filter value which matches both event trackers, like 1|2"""
+    return "{}|{}".format(metadata_cache.tracker_id(TRACKER_TERMIN), metadata_cache.tracker_id(TRACKER_TERMIN_EXT))
+
+
+def _iter_unique_issues(**fargs):
+    """Generator for issues matching `fargs`, fetched in a single paginated stream.
+    Issues can show up twice if they are updated while we page through the result,
+    so only the first occurence of an issue id is returned.
+    """
+    seen_ids = set()
+    for issue in iter_all(Issue, **fargs):
+        if issue.id not in seen_ids:
+            seen_ids.add(issue.id)
+            yield issue
+
+
+def get_event_issues(fetch_closed=False, start_dt=None, end_dt=None, records=False):
     """Fetch event issues from redmine server updated in a given time span
     ]start_dt, end_dt[.
     If no parameter is given, all issues are fetched.
+    Both event trackers are queried at once, issues are returned lazily by a generator.
     
     :param fetch_closed: Redmine fetches open issues by default, also get closed ones when True. 
     :param start_dt: datetime which marks the start of the time interval
     :param end_dt: datetime, end of the time interval
+    :param records: return read-only IssueRecord objects instead of Issue resources, much cheaper for syncing.
     """
     fargs = {}
     time_constraint = _make_time_constraint(start_dt, end_dt)
+    if records:
+        fargs["build"] = IssueRecord.from_dict
     if fetch_closed:
         fargs["status_id"]= "*"
     if time_constraint:
         fargs["updated_on"] = time_constraint
-    termine = Issue.find(tracker_id=tracker_termin.id, **fargs)
-    termine_ext = Issue.find(tracker_id=tracker_termin_ext.id, **fargs)
-    return termine + termine_ext
+    return _iter_unique_issues(tracker_id=_event_tracker_filter(), **fargs)
     
 
+def is_syncable_issue(issue):
+    """True if `issue` is an event issue which should be published in ELSAEvent."""
+    return issue.status.name not in UNSYNCED_STATUSES
+
+
+def get_event_issues_by_id(issue_ids, batch_size=ISSUE_ID_BATCH_SIZE, records=False):
+    """Fetch event issues by id, `batch_size` ids per request with the issue_id filter.
+    Ids of missing issues and of issues which aren't event issues are silently ignored.
+    Issues are returned lazily by a generator, like :func:`get_event_issues`.
+    
+    :param issue_ids: iterable of Redmine issue ids
+    :param records: return read-only IssueRecord objects instead of Issue resources.
+    """
+    fargs = {"status_id": "*"}
+    if records:
+        fargs["build"] = IssueRecord.from_dict
+    issue_ids = sorted(set(issue_ids))
+    for start in range(0, len(issue_ids), batch_size):
+        id_filter = ",".join(str(i) for i in issue_ids[start:start + batch_size])
+        yield from _iter_unique_issues(issue_id=id_filter, tracker_id=_event_tracker_filter(), **fargs)
+
+
+def get_event_issues_by_start_date(start_dt=None, end_dt=None, build=None):
+    """Generator for all event issues (any status) which start in [start_dt, end_dt].
+    
+    :param build: function which builds the returned objects from the issue attributes, 
+        see :func:`eventsync.redmine.resourceaddons.iter_all`. Issue resources if None.
+    """
+    fargs = {"status_id": "*"}
+    time_constraint = _make_time_constraint(start_dt, end_dt)
+    if time_constraint:
+        fargs["start_date"] = time_constraint
+    if build is not None:
+        fargs["build"] = build
+    return iter_all(Issue, tracker_id=_event_tracker_filter(), **fargs)
+
+
+def get_event_issue_stamps():
+    """Generator for IssueStamp tuples (id, updated_on, project id, status name) of all event issues,
+    including closed ones. No issue objects are built, so this is cheap even for many thousand issues.
+    """
+    return _iter_unique_issues(tracker_id=_event_tracker_filter(), status_id="*", build=issue_stamp)
+
+
 def get_cancelled_issues(start_dt=None, end_dt=None):
     """Fetch cancelled issues from redmine server updated in a given time span
     ]start_dt, end_dt[.
     If no parameter is given, all issues are fetched.
+    Issues are returned lazily by a generator, like :func:`get_event_issues`.
     
     :param start_dt: datetime which marks the start of the time interval
     :param end_dt: datetime, end of the time interval
@@ -64,10 +140,8 @@ def get_cancelled_issues(start_dt=None, end_dt=None):
     time_constraint = _make_time_constraint(start_dt, end_dt)
     if time_constraint:
         fargs["updated_on"] = time_constraint
-    cancelled_status_id = next(IssueStatus.filter(lambda s: s.name == "Abgesagt")).id
-    c_termine = Issue.find(tracker_id=tracker_termin.id, status_id=cancelled_status_id, **fargs)
-    c_termine_ext = Issue.find(tracker_id=tracker_termin_ext.id, status_id=cancelled_status_id, **fargs)
-    return c_termine + c_termine_ext
+    cancelled_status_id = metadata_cache.issue_status_id("Abgesagt")
+    return _iter_unique_issues(tracker_id=_event_tracker_filter(), status_id=cancelled_status_id, **fargs)
 
 
 def get_event_templates(start_dt=None, end_dt=None):
@@ -82,62 +156,139 @@ def get_event_templates(start_dt=None, end_dt=None):
     time_constraint = _make_time_constraint(start_dt, end_dt)
     if time_constraint:
         fargs["created_on"] = time_constraint
-    event_templates = Issue.find(tracker_id=tracker_template.id,  **fargs)
+    event_templates = Issue.find(tracker_id=metadata_cache.tracker_id(TRACKER_TEMPLATE),  **fargs)
     return event_templates
 
 
-def create_rrule_from_issue(issue_template):
-    """Create a rrule from an event template issue."""
-    start_dt = issue_template.start_date
-    end_dt = issue_template.due_date
-    
+def _rrule_options(wiederholungsart, start_dt, intervall=None):
+    weekday = start_dt.weekday()
     opts = { 
-        "Jede Woche": dict(freq=WEEKLY, byweekday=start_dt.weekday()),
-        "Tag im Monat": dict(freq=MONTHLY, bymonthday=start_dt.day),
-        "Abstand in Tagen": dict(freq=DAILY, interval=issue_template.intervall),
-        "Abstand in Wochen": dict(freq=WEEKLY, interval=issue_template.intervall),
-        "1. Wochentag im Monat": dict(freq=MONTHLY, byweekday=start_dt.weekday(), bysetpos=1),
-        "2. Wochentag im Monat": dict(freq=MONTHLY, byweekday=start_dt.weekday(), bysetpos=2),
-        "3. Wochentag im Monat": dict(freq=MONTHLY, byweekday=start_dt.weekday(), bysetpos=3),
-        "4. Wochentag im Monat": dict(freq=MONTHLY, byweekday=start_dt.weekday(), bysetpos=4),
+        "Jede Woche": lambda: dict(freq=WEEKLY, byweekday=weekday),
+        "Tag im Monat": lambda: dict(freq=MONTHLY, bymonthday=start_dt.day),
+        "Abstand in Tagen": lambda: dict(freq=DAILY, interval=int(intervall)),
+        "Abstand in Wochen": lambda: dict(freq=WEEKLY, interval=int(intervall)),
+        "1. Wochentag im Monat": lambda: dict(freq=MONTHLY, byweekday=weekday, bysetpos=1),
+        "2. Wochentag im Monat": lambda: dict(freq=MONTHLY, byweekday=weekday, bysetpos=2),
+        "3. Wochentag im Monat": lambda: dict(freq=MONTHLY, byweekday=weekday, bysetpos=3),
+        "4. Wochentag im Monat": lambda: dict(freq=MONTHLY, byweekday=weekday, bysetpos=4),
     }
-    chosen_opts = opts[issue_template.wiederholungsart]
-    return rrule(dtstart=start_dt, until=end_dt, **chosen_opts)
-    
+    return opts[wiederholungsart]()
+
+
+def create_rrule_from_issue(issue_template):
+    """Create a rrule from an event template issue."""
+    opts = _rrule_options(issue_template.wiederholungsart, issue_template.start_date, issue_template.intervall)
+    return rrule(dtstart=issue_template.start_date, until=issue_template.due_date, **opts)
+
+
+def _day_start(value):
+    return value if isinstance(value, datetime) else datetime.combine(value, time.min)
+
+
+def _day_end(value):
+    return value if isinstance(value, datetime) else datetime.combine(value, time.max)
+
+
+@lru_cache(maxsize=1024)
+def occurrence_dates(wiederholungsart, start_date, due_date, intervall=None, start=None, end=None):
+    """Dates of a recurrence in [start, end] as tuple of dates, computed once per recurrence and range and cached.
+    Only the requested range is expanded, not the whole recurrence.
+    Many templates share the same recurrence (weekly Stammtisch from the same start date), 
+    they get the same tuple.
+    Raises ValueError if neither `due_date` nor `end` limits the recurrence.
+    """
+    if due_date is None and end is None:
+        raise ValueError("recurrence without due date needs an end")
+    opts = _rrule_options(wiederholungsart, start_date, intervall)
+    rule = rrule(dtstart=start_date, until=due_date, **opts)
+    after = _day_start(start_date)
+    if start is not None:
+        after = max(after, _day_start(start))
+    before = _day_end(due_date) if due_date is not None else None
+    if end is not None:
+        before = min(before, _day_end(end)) if before is not None else _day_end(end)
+    return tuple(dt.date() for dt in rule.between(after, before, inc=True))
+
+
+def _precompile_template(text, values):
+    """Substitute the constant custom field values once, only $datum is left for the occurrences."""
+    # escape $ in values, they would be interpreted by the second substitution
+    escaped = {name: str(value).replace("$", "$$") for name, value in values.items() if name != "datum"}
+
+    def convert(mo):
+        name = mo.group("named") or mo.group("braced")
+        # keep $datum, $$ and unknown placeholders for the second substitution
+        return escaped[name] if name in escaped else mo.group()
+    return string.Template(string.Template.pattern.sub(convert, text or ""))
+
+
+class TemplateExpansion(object):
+    """Issues for all occurrences of an event template.
+    The constant part of the issues (project, tracker, custom fields) is built once, subjects and descriptions
+    are rendered from precompiled templates. Occurrences are plain dicts with the issue attributes,
+    ready to be posted (see :meth:`payloads`).
     
+    :param issue_template: template issue (tracker Terminvorlage).
+    """
+    def __init__(self, issue_template):
+        self.template_id = issue_template.id
+        tracker = TERMINART_TRACKERS.get(issue_template.terminart)
+        if tracker is None:
+            raise ValueError("unknown terminart {!r} in template #{}".format(issue_template.terminart, 
+                                                                             issue_template.id))
+        custom_fields = [cf for cf in issue_template.custom_fields if cf.name.lower() not in TEMPLATE_ONLY_FIELDS]
+        values = {cf.name.lower(): cf.value for cf in custom_fields}
+        self.base = dict(project_id=issue_template.project.id,
+                         tracker_id=metadata_cache.tracker_id(tracker),
+                         custom_fields=[dict(id=cf.id, name=cf.name, value=cf.value) for cf in custom_fields])
+        self.subject_tmpl = _precompile_template(issue_template.subject, values)
+        self.description_tmpl = _precompile_template(issue_template.description, values)
+        intervall = getattr(issue_template, "intervall", None)
+        self.recurrence = (issue_template.wiederholungsart, issue_template.start_date, issue_template.due_date,
+                           intervall)
+        # check the recurrence now, the dates are computed for the requested range by iter_dates
+        _rrule_options(issue_template.wiederholungsart, issue_template.start_date, intervall)
+
+    def iter_dates(self, start=None, end=None):
+        """Occurrence dates in [start, end], `end` is needed if the template has no due date."""
+        return occurrence_dates(*self.recurrence, start, end)
+
+    def payload(self, date):
+        """Issue attributes for the occurrence on `date`."""
+        readable_date_str = date.strftime(READABLE_DATE_FORMAT)
+        date_str = date.strftime(REDMINE_DATE_FORMAT)
+        payload = dict(self.base,
+                       subject=self.subject_tmpl.substitute(datum=readable_date_str),
+                       description=self.description_tmpl.substitute(datum=readable_date_str),
+                       start_date=date_str,
+                       due_date=date_str)
+        return payload
+
+    def payloads(self, start=None, end=None):
+        """List of (date, issue attributes) for all occurrences in [start, end]."""
+        return [(date, self.payload(date)) for date in self.iter_dates(start, end)]
+
+
 def new_issue_from_template(issue_template):
-    custom_fields = list(filter(lambda cf: cf.name.lower() not in ["intervall", "wiederholungsart", "terminart"], issue_template.custom_fields)) 
-    logg.info("custom fields: %s, %s", custom_fields ,[(cf.name, cf.value) for cf in custom_fields])
+    custom_fields = list(filter(lambda cf: cf.name.lower() not in TEMPLATE_ONLY_FIELDS, issue_template.custom_fields)) 
+    logg.debug("custom fields: %s", [(cf.name, cf.value) for cf in custom_fields])
     issue = Issue(dict(custom_fields=custom_fields))
     # XXX: works better when we assign it again, don't ask me why...
     issue.custom_fields = custom_fields
     issue.project_id = issue_template.project.id
-    if issue_template.terminart == "Termin":
-        issue.tracker_id = tracker_termin.id
-    elif issue_template.terminart == "Termin":
-        issue.tracker_id = tracker_termin_ext.id
-    else:
+    tracker = TERMINART_TRACKERS.get(issue_template.terminart)
+    if tracker is None:
         raise Exception("Whoops, not possible ;)")
-    logg.info("issue created: %s", issue)
-    logg.info("dict: %s", issue.__dict__)
+    issue.tracker_id = metadata_cache.tracker_id(tracker)
     return issue
 
 
-def create_issues_from_template(issue_template):
-    rrule = create_rrule_from_issue(issue_template)
-    subject_tmpl = string.Template(issue_template.subject)
-    description_tmpl = string.Template(issue_template.description)
-    created_issues = []
-    for dt in rrule:
-        issue = new_issue_from_template(issue_template)
-        readable_date_str = dt.strftime(READABLE_DATE_FORMAT) 
-        custom_fields = {k: cf.value for k, cf in issue._custom_fields.items()}
-        logg.info("custom_fields %s", custom_fields)
-        issue.subject = subject_tmpl.substitute(datum=readable_date_str, **custom_fields)
-        issue.description = description_tmpl.substitute(datum=readable_date_str, **custom_fields)
-        issue.start_date = dt
-        issue.due_date = dt
-        logg.info("creating issue from template %s", issue.attributes)
-        created_issues.append(issue)
-        
+def create_issues_from_template(issue_template, start=None, end=None):
+    """Create (unsaved) issues for all occurrences of an event template in [start, end].
+    
+    :param issue_template: template issue (tracker Terminvorlage).
+    """
+    expansion = TemplateExpansion(issue_template)
+    created_issues = [Issue(payload) for _, payload in expansion.payloads(start, end)]
+    logg.info("%s issues created from template #%s", len(created_issues), issue_template.id)
     return created_issues
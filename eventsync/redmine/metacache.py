@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+'''
+eventsync.redmine.metacache.py
+
+Persistent cache for nearly static Redmine resources (trackers, issue statuses, projects).
+Every resource type is fetched with a single listing and stored as name -> id index in a
+local JSON file. Entries expire after a per-type TTL and can be invalidated explicitly.
+Unknown tracker and status names raise a LookupError, they would end up as invalid filters or issue attributes.
+'''
+import json
+import logging
+import os
+import threading
+import time
+
+from .redmineapi import Tracker, IssueStatus, Project
+from .resourceaddons import iter_all
+
+logg = logging.getLogger(__name__)
+
+METADATA_CACHE_FILENAME = "eventsync.metacache"
+# increase when the cached data changes, older cache files are ignored then
+METADATA_CACHE_VERSION = 2
+
+# seconds until a cached listing is fetched again
+DEFAULT_TTLS = {
+    "trackers": 24 * 3600,
+    "issue_statuses": 24 * 3600,
+    "projects": 3600,
+}
+
+
+def _load_trackers():
+    # trackers are not paginated by Redmine, a plain find gets all of them
+    return {t.name: t.id for t in Tracker.find()}
+
+
+def _load_issue_statuses():
+    return {s.name: s.id for s in IssueStatus.find()}
+
+
+def _load_projects():
+    return {p.identifier: p.id for p in iter_all(Project)}
+
+
+LOADERS = {
+    "trackers": _load_trackers,
+    "issue_statuses": _load_issue_statuses,
+    "projects": _load_projects,
+}
+
+
+class MetadataCache(object):
+    """name -> id indices for Redmine resource types, persisted to `filename`.
+
+    :param filename: path of the cache file, None disables persistence.
+    :param ttls: dict resource type -> TTL in seconds, overrides DEFAULT_TTLS.
+    """
+    def __init__(self, filename=METADATA_CACHE_FILENAME, ttls=None):
+        self.filename = filename
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self._entries = None
+        # resource types fetched from the server by this process
+        self._fetched = set()
+        self._lock = threading.RLock()
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        if self.filename and os.path.exists(self.filename):
+            try:
+                with open(self.filename) as f:
+                    content = json.load(f)
+            except (IOError, ValueError) as e:
+                logg.warn("ignoring unreadable metadata cache %s: %s", self.filename, e)
+                return
+            if not isinstance(content, dict) or content.get("version") != METADATA_CACHE_VERSION:
+                logg.info("ignoring metadata cache %s from another version", self.filename)
+                return
+            self._entries = content["entries"]
+
+    def _save(self):
+        if not self.filename:
+            return
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump({"version": METADATA_CACHE_VERSION, "entries": self._entries}, f)
+        os.replace(tmp_filename, self.filename)
+
+    def _is_fresh(self, resource_type, entry):
+        return time.time() - entry["fetched"] < self.ttls[resource_type]
+
+    def _refresh(self, resource_type):
+        logg.debug("fetching %s for metadata cache", resource_type)
+        entry = {"fetched": time.time(), "index": LOADERS[resource_type]()}
+        self._entries[resource_type] = entry
+        self._fetched.add(resource_type)
+        self._save()
+        return entry
+
+    def get(self, resource_type):
+        """Return the name -> id index for `resource_type`, fetch it if missing or expired."""
+        with self._lock:
+            self._load()
+            entry = self._entries.get(resource_type)
+            if entry is None or not self._is_fresh(resource_type, entry):
+                entry = self._refresh(resource_type)
+            return entry["index"]
+
+    def lookup(self, resource_type, name):
+        """Get the id for `name`, None if it doesn't exist.
+        An unknown name triggers one refetch if the index was read from the cache file,
+        so resources created since then are found.
+        """
+        with self._lock:
+            index = self.get(resource_type)
+            if name not in index and resource_type not in self._fetched:
+                index = self._refresh(resource_type)["index"]
+            return index.get(name)
+
+    def invalidate(self, resource_type=None):
+        """Drop the cached index for `resource_type` or for all types if None is given."""
+        with self._lock:
+            self._load()
+            if resource_type is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(resource_type, None)
+            self._save()
+
+    def _require(self, resource_type, name):
+        resource_id = self.lookup(resource_type, name)
+        if resource_id is None:
+            raise LookupError("{} {!r} doesn't exist in Redmine or is not accessible".format(resource_type, name))
+        return resource_id
+
+    def tracker_id(self, name):
+        """Id of the tracker `name`, raises LookupError if there is no such tracker."""
+        return self._require("trackers", name)
+
+    def issue_status_id(self, name):
+        """Id of the issue status `name`, raises LookupError if there is no such status."""
+        return self._require("issue_statuses", name)
+
+    def project_id(self, identifier):
+        return self.lookup("projects", identifier)
+
+
+metadata_cache = MetadataCache()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+'''
+eventsync.redmine.records.py
+
+Compact read-only representation of event issues for the sync.
+Records are built directly from the decoded API response, without ActiveResource objects.
+'''
+from collections import namedtuple
+from datetime import time
+import logging
+
+from .localsettings import REDMINE_DATETIME_FORMAT, REDMINE_DATE_FORMAT
+from .resourceaddons import make_time_parser
+
+logg = logging.getLogger(__name__)
+
+# reference to another resource like the project or status of an issue
+ResourceRef = namedtuple("ResourceRef", "id name")
+# version of an issue, enough to decide if it has to be synced
+IssueStamp = namedtuple("IssueStamp", "id updated_on project_id status")
+
+_parse_datetime = make_time_parser(REDMINE_DATETIME_FORMAT)
+_parse_date = make_time_parser(REDMINE_DATE_FORMAT)
+
+
+def _parse_clock_time(value):
+    """Parse time values like 19:00 or 19:00:00 from custom fields, None if not possible."""
+    if not value:
+        return None
+    try:
+        return time.fromisoformat(value.strip())
+    except ValueError:
+        logg.debug("invalid time value %r", value)
+        return None
+
+
+def _ref(attributes):
+    if not attributes:
+        return None
+    return ResourceRef(attributes.get("id"), attributes.get("name"))
+
+
+class IssueRecord(object):
+    """Read-only event issue with the attributes needed for syncing.
+    Attribute names are the same as for :class:`eventsync.redmine.redmineapi.Issue`,
+    so records can be used by the sync instead of full resource objects.
+    """
+    __slots__ = ("id", "subject", "description", "project", "tracker", "status", 
+                 "start_date", "due_date", "created_on", "updated_on",
+                 "startzeit", "ende", "veranstaltungsort", "adresse", "kategorien")
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            object.__setattr__(self, name, fields.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("IssueRecord is read-only")
+
+    def __repr__(self):
+        return "IssueRecord({})".format(self.id)
+
+    @property
+    def project_id(self):
+        return self.project.id if self.project else None
+
+    @classmethod
+    def from_dict(cls, attributes, prefix_options=None):
+        """Build a record from a decoded issue element of the Redmine API.
+        The signature matches ActiveResource._build_object, so it can be used as `build` function for
+        :func:`eventsync.redmine.resourceaddons.iter_pages`.
+        """
+        custom_fields = {cf["name"].lower(): cf.get("value") for cf in attributes.get("custom_fields") or []}
+        kategorien = custom_fields.get("kategorien") or []
+        if not isinstance(kategorien, list):
+            kategorien = [kategorien]
+        date_values = {}
+        for name, parse in (("start_date", _parse_date), ("due_date", _parse_date), 
+                            ("created_on", _parse_datetime), ("updated_on", _parse_datetime)):
+            value = attributes.get(name)
+            date_values[name] = parse(value) if value else None
+        return cls(
+            id=attributes.get("id"),
+            subject=attributes.get("subject"),
+            description=attributes.get("description"),
+            project=_ref(attributes.get("project")),
+            tracker=_ref(attributes.get("tracker")),
+            status=_ref(attributes.get("status")),
+            startzeit=_parse_clock_time(custom_fields.get("startzeit")),
+            ende=_parse_clock_time(custom_fields.get("ende")),
+            veranstaltungsort=custom_fields.get("veranstaltungsort"),
+            adresse=custom_fields.get("adresse"),
+            kategorien=kategorien,
+            **date_values)
+
+
+def issue_stamp(attributes, prefix_options=None):
+    """Build an IssueStamp from a decoded issue element, usable as `build` function like IssueRecord.from_dict."""
+    updated_on = attributes.get("updated_on")
+    return IssueStamp(attributes.get("id"),
+                      _parse_datetime(updated_on) if updated_on else None,
+                      (attributes.get("project") or {}).get("id"),
+                      (attributes.get("status") or {}).get("name"))
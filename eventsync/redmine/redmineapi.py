@@ -1,7 +1,9 @@
 import logging
 from pyactiveresource.activeresource import ActiveResource
-from .resourceaddons import find_extended, get_all_resource_objects, find_by_attrib
+from .resourceaddons import find_extended, get_all_resource_objects, find_by_attrib, iter_all
 from .localsettings import API_SITE
+from .formats import RedmineJSONFormat
+from .transport import PooledResourceMeta
 from eventsync.redmine.resourceaddons import date_attrib, datetime_attrib,\
     custom_fields
 
@@ -17,8 +19,10 @@ def make_logger():
     return logg
 
 
-class BaseRedmineResource(ActiveResource):
+class BaseRedmineResource(ActiveResource, metaclass=PooledResourceMeta):
     _site = API_SITE
+    # all resources share the connection of this class, so the format must be set here
+    _format = RedmineJSONFormat
     _headers = {}
     _all_limit = 100
     all = classmethod(get_all_resource_objects)
@@ -35,32 +39,11 @@ class BaseRedmineResource(ActiveResource):
 
     @classmethod
     def map(cls, func):
-        offset = 0
-        limit = 60
-        cur_result = [None]
-        result = []
-        while cur_result:
-            logg.debug("getting %ix %s offset %s", limit, cls, offset)
-            cur_result = cls.find(limit=limit, offset=offset)
-            mapped = map(func, cur_result)
-            result += mapped
-            offset += len(cur_result)
-        return result
+        return list(map(func, iter_all(cls)))
 
     @classmethod
     def filter(cls, func):
-        offset = 0
-        limit = 60
-        cur_result = [None]
-        result = []
-        while cur_result:
-            logg.debug("getting %ix %s offset %s", limit, cls, offset)
-            cur_result = cls.find(limit=limit, offset=offset)
-            logg.debug("current result %s", cur_result)
-            filtered = filter(func, cur_result)
-            result += filtered
-            offset += len(cur_result)
-        return result
+        return list(filter(func, iter_all(cls)))
 
 
 @find_extended
@@ -1,23 +1,120 @@
 import logging
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
 from pyactiveresource.activeresource import ActiveResource
 from functools import wraps, partial
 from datetime import datetime, time, date
 
 from .localsettings import REDMINE_DATETIME_FORMAT, REDMINE_DATE_FORMAT, REDMINE_TIME_FORMAT
+from eventsync.metrics import metrics
 from pyactiveresource.element_containers import ElementDict
 
 logg = logging.getLogger(__name__)
 
+# default page size for paginated Redmine collections
+PAGE_LIMIT = 60
+# max. number of pages fetched concurrently, 1 means strictly sequential
+PAGE_FETCH_WORKERS = 4
+
+_total_count_re = re.compile(br'total_count="(\d+)"')
+
+
+def _parse_total_count(body):
+    """Read the total_count attribute from the root element of a XML collection response.
+    Returns None if the server didn't send it (old Redmine versions, non-paginated resources).
+    """
+    match = _total_count_re.search(body[:512])
+    return int(match.group(1)) if match else None
+
+
+def fetch_page(cls, offset, limit, build=None, **kwargs):
+    """Fetch a single page of a Redmine collection.
+
+    :param cls: resource class
+    :param offset: index of the first object
+    :param limit: max. number of objects on this page
+    :param build: function (attributes, prefix_options) -> object, creates resource objects by default.
+    :returns: (list of resource objects, total_count or None)
+    """
+    build = build or cls._build_object
+    prefix_options, query_options = cls._split_options(kwargs)
+    query_options["offset"] = offset
+    query_options["limit"] = limit
+    path = cls._collection_path(prefix_options, query_options)
+    logg.debug("getting %ix %s offset %s", limit, cls.__name__, offset)
+    response = cls.connection.get(path, cls.headers)
+    metrics.incr("pages")
+    with metrics.timer("parse"):
+        decode_collection = getattr(cls.format, "decode_collection", None)
+        if decode_collection is not None:
+            elements, total_count = decode_collection(response.body)
+        else:
+            total_count = _parse_total_count(response.body)
+            elements = cls.format.decode(response.body)
+        elements = elements or []
+        if isinstance(elements, dict):
+            elements = [elements]
+        return [build(el, prefix_options) for el in elements], total_count
+
+
+def _first_id(page):
+    return getattr(page[0], "id", None)
+
+
+def iter_pages(cls, limit=PAGE_LIMIT, workers=PAGE_FETCH_WORKERS, build=None, **kwargs):
+    """Generator which yields all pages of a Redmine collection in server order.
+    The first page tells us the total count of objects, the remaining pages are fetched
+    concurrently by at most `workers` threads. Only a small window of pages is requested ahead,
+    so a slow consumer doesn't cause the whole collection to pile up in memory.
+    Falls back to sequential fetching until an empty page is returned if no total count is known.
+
+    :param cls: resource class
+    :param limit: page size
+    :param workers: max. number of concurrent requests
+    :param build: function which creates objects from decoded elements, see :func:`fetch_page`
+    :param kwargs: query options for the collection
+    """
+    page, total_count = fetch_page(cls, 0, limit, build, **kwargs)
+    if not page:
+        return
+    yield page
+    step = len(page)
+    if total_count is None or workers <= 1:
+        offset = step
+        while page and (total_count is None or offset < total_count):
+            last_page = page
+            page, _ = fetch_page(cls, offset, limit, build, **kwargs)
+            if total_count is None and page and _first_id(page) == _first_id(last_page):
+                # resource isn't paginated by the server, offset is ignored and we already have everything
+                return
+            if page:
+                yield page
+            offset += len(page)
+        return
+
+    offsets = iter(range(step, total_count, step))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # sliding window of requested pages, results are consumed in submission order
+        pending = deque(executor.submit(fetch_page, cls, offset, limit, build, **kwargs)
+                        for offset in islice(offsets, workers))
+        while pending:
+            page, _ = pending.popleft().result()
+            offset = next(offsets, None)
+            if offset is not None:
+                pending.append(executor.submit(fetch_page, cls, offset, limit, build, **kwargs))
+            if page:
+                yield page
+
+
+def iter_all(cls, **kwargs):
+    """Generator which yields all objects of a Redmine collection, see :func:`iter_pages`."""
+    return chain.from_iterable(iter_pages(cls, **kwargs))
+
 
 def get_all_resource_objects(cls):
-    offset = 0
-    cur_result = [None]
-    result = []
-    while cur_result:
-        cur_result = cls.find(limit=cls._all_limit, offset=offset)
-        result += cur_result
-        offset += len(cur_result)
-    return result
+    return list(iter_all(cls, limit=cls._all_limit))
 
 
 def find_extended(cls):
@@ -25,19 +122,14 @@ def find_extended(cls):
         """Find which searches all objects. 
         Redmine returns only a limited number of objects for some resources,
         so we have to repeat the query multiple times.
+        The pages are fetched concurrently, see :func:`iter_pages`.
         """
-        cur_result = [None]
-        result = []
+        if args or "from_" in kwargs:
+            return cls._find_orig(*args, **kwargs)
         fargs = kwargs.copy()
-        fargs["offset"] = 0
-        fargs["limit"] = 60
-        while cur_result:
-            cur_result = cls._find_orig(*args, **fargs)
-            if isinstance(cur_result, cls):
-                return cur_result
-            result += cur_result
-            fargs["offset"] += len(cur_result)
-        return result
+        fargs.pop("offset", None)
+        limit = fargs.pop("limit", PAGE_LIMIT)
+        return list(iter_all(cls, limit=limit, **fargs))
     
     cls._find_orig = cls.find
     cls.find = classmethod(_find_extended)
@@ -68,16 +160,7 @@ def find_by_attrib(attrib):
             return None
 
         def __find_all_by_attrib(cls, value):
-            offset = 0
-            limit = 60
-            cur_result = [None]
-            result = []
-            while cur_result:
-                cur_result = find_meth(limit=limit, offset=offset)
-                filtered = filter(lambda u: getattr(u, attrib) == value, cur_result)
-                result += filtered
-                offset += len(cur_result)
-            return result
+            return [obj for obj in iter_all(cls) if getattr(obj, attrib) == value]
         
         setattr(cls, "find_first_by_" + attrib, classmethod(__find_first_by_attrib))
         setattr(cls, "find_all_by_" + attrib, classmethod(__find_all_by_attrib))
@@ -86,6 +169,41 @@ def find_by_attrib(attrib):
     return _find_by_attrib
 
 
+def make_time_parser(time_format):
+    """Return a function which parses strings in `time_format` like datetime.strptime does.
+    The fixed ISO 8601 formats used by Redmine are handled by the much faster fromisoformat,
+    strptime is only used for other formats or unexpected values.
+    """
+    def _strptime(value):
+        return datetime.strptime(value, time_format)
+
+    if time_format == "%Y-%m-%dT%H:%M:%SZ":
+        def _parse(value):
+            if len(value) == 20 and value[10] == "T" and value[19] == "Z":
+                return datetime.fromisoformat(value[:19])
+            return _strptime(value)
+    elif time_format == "%Y-%m-%d":
+        def _parse(value):
+            if len(value) == 10:
+                return datetime.fromisoformat(value)
+            return _strptime(value)
+    elif time_format == "%H:%M:%S":
+        # strptime returns a datetime on 1900-01-01 for a time format
+        def _parse(value):
+            if len(value) == 8:
+                return datetime.combine(date(1900, 1, 1), time.fromisoformat(value))
+            return _strptime(value)
+    else:
+        return _strptime
+
+    def parse(value):
+        try:
+            return _parse(value)
+        except ValueError:
+            return _strptime(value)
+    return parse
+
+
 # factory function, see below for derived decorators
 
 def _datetime_attrib(klass, attrib):
@@ -97,18 +215,29 @@ def _datetime_attrib(klass, attrib):
         time_format = REDMINE_DATETIME_FORMAT
     else:
         raise TypeError("klass must be 'date', 'time' or 'datetime' class!")
+    parse = make_time_parser(time_format)
         
     def __datetime_attrib(cls):
+        # parsed values are memoized per instance as (raw value, parsed value).
+        # The raw value is compared on every access, so a changed attribute is parsed again.
         def _get(self):
             value = self.attributes[attrib]
             if value is None:
                 return None
-            return datetime.strptime(value, time_format)
+            parsed_attribs = self.__dict__.setdefault("_parsed_attribs", {})
+            cached = parsed_attribs.get(attrib)
+            if cached is not None and cached[0] is value:
+                return cached[1]
+            parsed = parse(value)
+            parsed_attribs[attrib] = (value, parsed)
+            return parsed
             
         def _set(self, value):
+            self.__dict__.get("_parsed_attribs", {}).pop(attrib, None)
             self.attributes[attrib] = datetime.strftime(value, time_format)
             
         def _del(self):
+            self.__dict__.get("_parsed_attribs", {}).pop(attrib, None)
             del self.attributes[attrib]
             
         prop = property(_get, _set, _del, "{} property, returns a {} object".format(attrib, klass.__name__))
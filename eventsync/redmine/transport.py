@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+'''
+eventsync.redmine.transport.py
+
+HTTP transport for the Redmine resources: a pyactiveresource connection which keeps
+connections to the Redmine host alive and reuses them, with gzip and retries.
+'''
+import gzip
+import http.client
+import logging
+import queue
+import threading
+from time import sleep
+from urllib.parse import urljoin, urlparse
+
+from pyactiveresource import connection
+from pyactiveresource.activeresource import ResourceMeta
+
+from . import httpcache
+from eventsync.metrics import metrics
+
+logg = logging.getLogger(__name__)
+
+# max. number of open connections to the Redmine host
+HTTP_POOL_SIZE = 8
+# socket timeout in seconds, used if the resource class doesn't set one
+HTTP_TIMEOUT = 30
+# retries for 429 / 5xx responses and network errors
+HTTP_MAX_RETRIES = 3
+# seconds to wait before the first retry, doubled for every further retry
+HTTP_RETRY_BACKOFF = 0.5
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE")
+
+
+def _header(headers, name):
+    """Case-insensitive header lookup"""
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+class _HTTPResult(object):
+    """Finished HTTP response, looks like the urllib response objects pyactiveresource expects."""
+    def __init__(self, url, code, msg, headers, body):
+        self.url = url
+        self.code = code
+        self.msg = msg
+        self.headers = headers
+        self._body = body
+
+    def read(self):
+        return self._body
+
+    def close(self):
+        pass
+
+
+class PooledConnection(connection.Connection):
+    """pyactiveresource connection with a pool of keep-alive HTTP(S) connections.
+    Responses with status 429 or 5xx and network errors are retried with exponential backoff,
+    POST requests only on 429 because the server could have processed them already.
+    If a `response_cache` is given, GET requests are sent as conditional requests and
+    unchanged responses (304) are served from the cache.
+    """
+    def __init__(self, site, user=None, password=None, timeout=None, format=None,
+                 pool_size=None, max_retries=None, retry_backoff=None, response_cache=None):
+        connection.Connection.__init__(self, site, user, password, timeout or HTTP_TIMEOUT, format)
+        parts = urlparse(self.site)
+        self._scheme = parts.scheme
+        self._host = parts.hostname
+        self._port = parts.port
+        self.pool_size = pool_size or HTTP_POOL_SIZE
+        self.max_retries = HTTP_MAX_RETRIES if max_retries is None else max_retries
+        self.retry_backoff = HTTP_RETRY_BACKOFF if retry_backoff is None else retry_backoff
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self.response_cache = response_cache
+
+    def _new_http_connection(self):
+        if self._scheme == "https":
+            return http.client.HTTPSConnection(self._host, self._port, timeout=self.timeout)
+        return http.client.HTTPConnection(self._host, self._port, timeout=self.timeout)
+
+    def _request_once(self, method, url, headers, data):
+        """Send one request over an idle or new connection.
+        A reused connection may have been closed by the server while it was idle. If that shows up
+        before any response was received, an idempotent request is sent once more on a new connection.
+        Other errors (timeouts, broken responses) are raised, retries are up to the caller.
+        """
+        parts = urlparse(url)
+        target = parts.path + ("?" + parts.query if parts.query else "")
+        with self._slots:
+            try:
+                conn, reused = self._idle.get_nowait(), True
+            except queue.Empty:
+                conn, reused = self._new_http_connection(), False
+            while True:
+                try:
+                    conn.request(method, target, body=data, headers=headers)
+                    response = conn.getresponse()
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    conn.close()
+                    if not reused or method not in IDEMPOTENT_METHODS:
+                        raise
+                    logg.debug("idle connection was closed by the server, sending %s %s again", method, url)
+                    conn, reused = self._new_http_connection(), False
+                    continue
+                except (http.client.HTTPException, OSError):
+                    conn.close()
+                    raise
+                break
+            try:
+                body = response.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._idle.put(conn)
+        response_headers = dict(response.getheaders())
+        if (_header(response_headers, "Content-Encoding") or "").lower() == "gzip":
+            body = gzip.decompress(body)
+        return _HTTPResult(url, response.status, response.reason, response_headers, body)
+
+    def _retry_delay(self, attempt, result=None):
+        retry_after = _header(result.headers, "Retry-After") if result is not None else None
+        if retry_after and retry_after.isdigit():
+            return int(retry_after)
+        return self.retry_backoff * 2 ** attempt
+
+    def _open(self, method, path, headers=None, data=None):
+        url = urljoin(self.site, path)
+        self.log.info('%s %s', method, url)
+        request_headers = {"Accept-Encoding": "gzip", "Connection": "keep-alive"}
+        if headers:
+            request_headers.update(headers)
+        if self.auth:
+            request_headers["Authorization"] = "Basic " + self.auth
+        if data:
+            request_headers["Content-Type"] = self.format.mime_type
+        elif method in ["POST", "PUT"]:
+            # Some web servers need a content length on all POST/PUT operations
+            request_headers["Content-Type"] = self.format.mime_type
+            request_headers["Content-Length"] = "0"
+
+        cache_key = cached = None
+        if method == "GET" and self.response_cache is not None:
+            # results depend on the impersonated user, too
+            cache_key = "{} {}".format(request_headers.get("X-Redmine-Switch-User", ""), url)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                etag, last_modified, _, _ = cached
+                if etag:
+                    request_headers["If-None-Match"] = etag
+                if last_modified:
+                    request_headers["If-Modified-Since"] = last_modified
+
+        with metrics.timer("http"):
+            result = self._request_with_retries(method, url, request_headers, data)
+
+        if cache_key is not None:
+            result = self._use_response_cache(cache_key, cached, result)
+        response = connection.Response.from_httpresponse(self._handle_error(result))
+        self.log.info('--> %d %s %db', response.code, response.msg, len(response.body))
+        return response
+
+    def _request_with_retries(self, method, url, headers, data):
+        attempt = 0
+        while True:
+            metrics.incr("http_requests")
+            try:
+                result = self._request_once(method, url, headers, data)
+            except (http.client.HTTPException, OSError) as err:
+                if attempt >= self.max_retries or method not in IDEMPOTENT_METHODS:
+                    metrics.incr("http_errors")
+                    raise connection.Error(err, url)
+                delay = self._retry_delay(attempt)
+                logg.warn("%s %s failed: %s, retrying in %ss", method, url, err, delay)
+            else:
+                retry = result.code == 429 or (500 <= result.code < 600 and method in IDEMPOTENT_METHODS)
+                if not retry or attempt >= self.max_retries:
+                    metrics.incr("http_bytes", len(result.read()))
+                    return result
+                delay = self._retry_delay(attempt, result)
+                logg.warn("%s %s returned %s, retrying in %ss", method, url, result.code, delay)
+            metrics.incr("http_retries")
+            sleep(delay)
+            attempt += 1
+
+    def _use_response_cache(self, cache_key, cached, result):
+        """Replace a 304 result by the cached response, store cacheable 200 results."""
+        if result.code == 304 and cached is not None:
+            logg.debug("%s not modified, using cached response", result.url)
+            metrics.incr("http_not_modified")
+            self.response_cache.touch(cache_key)
+            _, _, headers, body = cached
+            return _HTTPResult(result.url, 200, "OK", headers, body)
+        if result.code == 200:
+            etag = _header(result.headers, "ETag")
+            last_modified = _header(result.headers, "Last-Modified")
+            if etag or last_modified:
+                self.response_cache.put(cache_key, etag, last_modified, result.headers, result.read())
+        return result
+
+
+class PooledResourceMeta(ResourceMeta):
+    """Metaclass which gives resource classes a shared PooledConnection instead of
+    the pyactiveresource connection, which opens a new connection for every request.
+    """
+    @property
+    def connection(cls):
+        # the class which defines the site owns the connection, subclasses share it
+        owner = next(klass for klass in cls.__mro__ if "_connection" in klass.__dict__)
+        if owner._connection is None:
+            # the filename is read now, a changed setting isn't seen by the default argument
+            response_cache = httpcache.ResponseCache(httpcache.HTTP_CACHE_FILENAME) \
+                if httpcache.HTTP_CACHE_FILENAME else None
+            owner._connection = PooledConnection(owner.site, owner.user, owner.password,
+                                                 owner.timeout, owner.format, response_cache=response_cache)
+        return owner._connection
@@ -6,108 +6,409 @@ Created on 15.03.2013
 
 Fetches event tickets from redmine and writes them to an ELSAEvent database.
 '''
+from collections import namedtuple
 from configparser import ConfigParser
 from dateutil.rrule import rrule 
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import cached_property
+from itertools import islice
 import logging
-from sqlalchemy.sql import and_
+import threading
 
-from .redmine.redmineapi import Project
-from .elsaevent.datamodel import Event, User, Group, Category, Status
+from .redmine.metacache import metadata_cache
+from .redmine.issues import get_event_issues_by_id, get_event_issue_stamps, is_syncable_issue, UNSYNCED_STATUSES
+from .fingerprints import FingerprintStore, event_fingerprint
+from .metrics import metrics
+from .elsaevent.datamodel import Event, User, Group, Category, Status, categories_events, EventsNotification, \
+    EventsUser
 from . import elsaevent
 from .redmine.localsettings import REDMINE_HOST, REDMINE_SCHEMA, REDMINE_DATETIME_FORMAT
 from .elsaevent.localsettings import ELSA_REDMINE_USERNAME, ELSA_DEFAULT_CATEGORY
 
 logg = logging.getLogger(__name__)
 URL_PATTERN = "{}://{}/issues/".format(REDMINE_SCHEMA, REDMINE_HOST)
+MAPPINGS_FILENAME = "eventsync/mappings"
+EVENT_REMARKS = "Hinweis: Event automatisch generiert von redmine_elsa_sync. Bitte nicht verändern, sonst gibt's Ärger!"
+# number of events written by one executemany statement in bulk mode
+BULK_BATCH_SIZE = 500
+# max. number of urls in one IN clause when matching issues to events
+MATCH_CHUNK_SIZE = 500
+# number of issues synced and committed together by sync_event_issues
+SYNC_BATCH_SIZE = 200
+# number of partitions synced in parallel by sync_event_issues_partitioned
+SYNC_WORKERS = 4
+# the reconcile refuses to delete more than this fraction of all events, protects against broken mappings
+RECONCILE_MAX_ORPHAN_RATIO = 0.5
 
-esession = elsaevent.session
-query = esession.query 
-event_query = query(Event)
 
-redmine_user = query(User).filter_by(username=ELSA_REDMINE_USERNAME).one()
-default_category = query(Category).filter_by(name=ELSA_DEFAULT_CATEGORY).one()
-status_new = query(Status).filter_by(name="Neu").one()
-status_confirmed = query(Status).filter_by(name="Bestätigt").one()
-status_cancelled = query(Status).filter_by(name="Abgesagt").one()
+class SyncStopped(Exception):
+    """Raised by an `on_batch_committed` callback to stop a sync after the committed batch, for example on shutdown.
+    A partitioned sync stops all partitions and raises it again.
+    """
 
 
-def load_project_mappings():
+def load_project_mappings(session, mappings_filename=MAPPINGS_FILENAME, unresolved_groups=None):
     """Map a project id (Redmine) to a group id (ELSAEvent).
     Every mapping must be defined.
     Fails when groups are not found.
+    Project ids are resolved by the metadata cache, which needs only one project listing.
+    
+    :param unresolved_groups: set, the ids of groups whose project couldn't be resolved are added to it.
     """
     c = ConfigParser()
-    c.read_file(open("eventsync/mappings"))
+    with open(mappings_filename) as f:
+        c.read_file(f)
     project_mappings = {}
     for project_name, group_name in c.items("projects"):
-        project = Project.find_first_by_identifier(project_name)
-        if project is None:
+        project_id = metadata_cache.project_id(project_name)
+        if project_id is None:
             logg.warn("project %s doesn't exist or is not accessible!", project_name)
+            if unresolved_groups is not None:
+                group = session.query(Group.id).filter_by(name=group_name).one_or_none()
+                if group is not None:
+                    unresolved_groups.add(group.id)
         else:
-            group_id = query(Group.id).filter_by(name=group_name).one().id
-            project_mappings[project.id] = group_id
+            group_id = session.query(Group.id).filter_by(name=group_name).one().id
+            project_mappings[project_id] = group_id
     return project_mappings
 
 
-project_mappings = load_project_mappings()
+class SyncContext(object):
+    """State needed for syncing: ELSAEvent session, some DB rows we refer to and the project mappings.
+    Nothing is loaded before first access, loaded values are kept for later sync cycles.
+
+    :param session: SQLAlchemy session for ELSAEvent, default is the shared session of `elsaevent`.
+    :param project_mappings: dict Redmine project id -> ELSAEvent group id, loaded from the mappings file if None.
+        Groups of mappings whose project couldn't be resolved are in `unresolved_groups` after loading.
+    :param fingerprints: FingerprintStore for skipping unchanged events, default store file if None.
+    """
+    def __init__(self, session=None, project_mappings=None, fingerprints=None):
+        self._session = session
+        self._categories = None
+        self._missing_categories = set()
+        self._pending_fingerprints = {}
+        self._pending_versions = {}
+        self._pending_counts = {}
+        self.unresolved_groups = set()
+        if project_mappings is not None:
+            self.__dict__["project_mappings"] = project_mappings
+        if fingerprints is not None:
+            self.__dict__["fingerprints"] = fingerprints
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = elsaevent.get_session()
+        return self._session
+
+    def query(self, *entities):
+        return self.session.query(*entities)
+
+    def _status(self, name):
+        return self.query(Status).filter_by(name=name).one()
+
+    @cached_property
+    def redmine_user(self):
+        return self.query(User).filter_by(username=ELSA_REDMINE_USERNAME).one()
+
+    @cached_property
+    def default_category(self):
+        return self.query(Category).filter_by(name=ELSA_DEFAULT_CATEGORY).one()
+
+    @cached_property
+    def status_new(self):
+        return self._status("Neu")
+
+    @cached_property
+    def status_confirmed(self):
+        return self._status("Bestätigt")
+
+    @cached_property
+    def status_cancelled(self):
+        return self._status("Abgesagt")
+
+    @cached_property
+    def project_mappings(self):
+        return load_project_mappings(self.session, unresolved_groups=self.unresolved_groups)
+
+    @cached_property
+    def fingerprints(self):
+        return FingerprintStore()
+
+    def remember_fingerprint(self, url, fingerprint):
+        """Store fingerprint for an event when the current transaction is committed."""
+        self._pending_fingerprints[url] = fingerprint
+
+    def remember_version(self, url, updated_on):
+        """Store the update time of the issue synced to an event when the current transaction is committed."""
+        if updated_on is not None:
+            self._pending_versions[url] = updated_on
+
+    def count_on_commit(self, name, value=1):
+        """Increment the counter `name` of the metrics when the current transaction is committed."""
+        self._pending_counts[name] = self._pending_counts.get(name, 0) + value
+
+    def commit(self):
+        """Commit the session, then store the fingerprints and issue versions of the synced events."""
+        try:
+            with metrics.timer("flush"):
+                self.session.flush()
+            with metrics.timer("commit"):
+                self.session.commit()
+        except:
+            self.rollback()
+            raise
+        if self._pending_fingerprints:
+            self.fingerprints.update(self._pending_fingerprints)
+            self._pending_fingerprints.clear()
+        if self._pending_versions:
+            self.fingerprints.update_versions(self._pending_versions)
+            self._pending_versions.clear()
+        for name, value in self._pending_counts.items():
+            metrics.incr(name, value)
+        self._pending_counts.clear()
+
+    def rollback(self):
+        """Roll back the session, forget what was remembered for the events written since the last commit."""
+        self._pending_fingerprints.clear()
+        self._pending_versions.clear()
+        self._pending_counts.clear()
+        self.session.rollback()
+
+    def event_status(self, issue_status_name):
+        """ELSAEvent Status for a Redmine issue status name, None if there is no matching status."""
+        if issue_status_name == "Neu":
+            return self.status_new
+        elif issue_status_name == "Bestätigt":
+            return self.status_confirmed
+        elif issue_status_name == "Abgesagt":
+            return self.status_cancelled
+        return None
+
+    def _load_categories(self):
+        self._categories = {c.name: c for c in self.query(Category)}
+
+    def refresh_categories(self):
+        """Reload the category index, should be called once per sync."""
+        self._load_categories()
+        self._missing_categories.clear()
+
+    def category(self, name):
+        """Get Category by name from the in-memory index, None if it doesn't exist.
+        Unknown names reload the index once, categories could have been added since the last load.
+        """
+        if self._categories is None:
+            self._load_categories()
+        if name not in self._categories and name not in self._missing_categories:
+            self._load_categories()
+            if name not in self._categories:
+                self._missing_categories.add(name)
+        return self._categories.get(name)
+
+    def reset(self):
+        """Forget all loaded values, they are fetched again on next access."""
+        for attrib in [k for k, v in vars(type(self)).items() if isinstance(v, cached_property)]:
+            self.__dict__.pop(attrib, None)
+        self._categories = None
+        self._missing_categories.clear()
+        self.unresolved_groups.clear()
+
+
+_context = None
+
+
+def get_context():
+    """Return the default sync context, create it on first use."""
+    global _context
+    if _context is None:
+        _context = SyncContext()
+    return _context
+
+
+def set_context(context):
+    """Replace the default sync context, for example with one using another session."""
+    global _context
+    _context = context
+
+
+def _event_values(ctx, issue, url):
+    """Column values and categories for the event which represents `issue`.
+    
+    :returns: (dict column name -> value, list of Category objects), (None, None) if project for issue is not mapped.
+    """
+    group_id = ctx.project_mappings.get(issue.project.id)
+    if group_id is None:
+        return None, None
+    status = ctx.event_status(issue.status.name)
+    if status is None:
+        raise Exception("wrong issue status {} for issue #{}".format(issue.status.name, issue.id))
+    values = dict(
+        group_id=group_id,
+        url=url,
+        title=issue.subject,
+        startdate=issue.start_date,
+        enddate=issue.due_date,
+        body=issue.description,
+        status_id=status.id,
+        user_id=ctx.redmine_user.id,
+        starttime=issue.startzeit,
+        endtime=issue.ende,
+        location=issue.veranstaltungsort or "unbekannt",
+        address=issue.adresse,
+        remarks=EVENT_REMARKS,
+        timezone="Europe/Berlin",
+        alias="")
+    # multi value field is given as a simple list
+    categories = [c for c in map(ctx.category, issue.kategorien) if c is not None]
+    # XXX: remove after testing!
+    # no category given by category field or custom field, we have to assign some default category
+    if not categories:
+        categories = [ctx.default_category]
+    return values, categories
 
 
-def create_or_update_event_from_issue(issue, url, event=None):
+def create_or_update_event_from_issue(issue, url, event=None, context=None):
     """Conversion from redmine resource object (issue) to ELSAEvent DB object (event).
     
     :param issue: activeResource objects which represents an event.
     :param url: Redmine API URL for the event like https://red.de/issues/123
     :param event: event DB object to update. Create new one if none is given.
+    :param context: SyncContext to use, default context if None.
     :returns: Updated or created event object. None if project for issue is not mapped.
     """
+    ctx = context or get_context()
+    values, categories = _event_values(ctx, issue, url)
+    if values is None:
+        logg.warn("don't create event for unmapped project %s (issue #%s)", issue.project.id, issue.id)
+        return None
+    return _apply_event_values(values, categories, event)
+
+
+def _apply_event_values(values, categories, event=None):
     now = datetime.utcnow()
     if not event:
         event = Event()
         event.created = now
     assert isinstance(event, Event)
-    event.group_id = project_mappings.get(issue.project.id)
-    if event.group_id is None:
-        logg.warn("don't create event for unmapped project %s (issue #%s)", issue.project.id, issue.id)
-        return None
+    for attrib, value in values.items():
+        setattr(event, attrib, value)
     event.modified = now
-    event.url = url
-    event.title = issue.subject
-    event.startdate = issue.start_date
-    event.enddate = issue.due_date
-    event.body = issue.description
-    if issue.status.name == "Neu":
-        event.status = status_new
-    elif issue.status.name == "Bestätigt":
-        event.status = status_confirmed
-    elif issue.status.name == "Abgesagt":
-        event.status = status_cancelled
-    else:
-        raise Exception("wrong issue status {} for issue #{}".format(issue.status.name, issue.id))
-    event.user = redmine_user
-    event.starttime = issue.startzeit
-    event.endtime = issue.ende
-    event.location = issue.veranstaltungsort
-    event.address = issue.adresse
-    # multi value field is given as a simple list
-    for category_name in issue.kategorien:
-        category = query(Category).filter_by(name=category_name).first()
-        if category is not None:
-            event.categories.append(category)
-            
-    event.remarks = "Hinweis: Event automatisch generiert von redmine_elsa_sync. Bitte nicht verändern, sonst gibt's Ärger!"
-    event.timezone = "Europe/Berlin"
-    event.alias = ""
-    # XXX: remove after testing!
-    # no category given by category field or custom field, we have to assign some default category
-    if not event.categories:
-        event.categories.append(default_category)
-    if not event.location:
-        event.location = "unbekannt"
+    event.categories = categories
     return event
 
 
-def _update_existing_event(last_update_dt, urls_to_issues, event):
+class BulkEventWriter(object):
+    """Collects new and changed events and writes them in batches with executemany-style statements,
+    instead of flushing every ORM object on its own.
+    Nothing is committed, that's up to the caller. If a write fails, its queue is dropped and the
+    exception is raised, the caller has to roll back the transaction.
+    Written events are counted when the context commits.
+    
+    :param ctx: SyncContext
+    :param batch_size: :meth:`flush_full` writes pending inserts / updates when this many are collected.
+    """
+    def __init__(self, ctx, batch_size=BULK_BATCH_SIZE):
+        self.ctx = ctx
+        self.batch_size = batch_size
+        self._inserts = []
+        self._updates = []
+
+    def insert(self, values, categories):
+        """Queue a new event, see :func:`_event_values`."""
+        self._inserts.append((values, categories))
+
+    def update(self, event, values, categories):
+        """Queue an update of `event` with new values."""
+        self._updates.append((dict(values, id=event.id), categories))
+
+    def flush_full(self):
+        """Write the queues which reached the batch size."""
+        if len(self._inserts) >= self.batch_size:
+            self._flush_inserts()
+        if len(self._updates) >= self.batch_size:
+            self._flush_updates()
+
+    def flush(self):
+        self._flush_inserts()
+        self._flush_updates()
+
+    def _insert_categories(self, event_ids_categories):
+        rows = [dict(event_id=event_id, category_id=category.id) 
+                for event_id, categories in event_ids_categories for category in categories]
+        if rows:
+            self.ctx.session.execute(categories_events.insert(), rows)
+
+    @metrics.timed("flush")
+    def _flush_inserts(self):
+        inserts, self._inserts = self._inserts, []
+        if not inserts:
+            return
+        session = self.ctx.session
+        # without microseconds, MySQL DATETIME columns don't store them
+        now = datetime.utcnow().replace(microsecond=0)
+        rows = [dict(values, created=now, modified=now) for values, _ in inserts]
+        session.execute(Event.__table__.insert(), rows)
+        # executemany doesn't give us the new primary keys, select the rows we just inserted by url
+        urls = [row["url"] for row in rows]
+        url_to_id = dict(session.query(Event.url, Event.id).filter(Event.url.in_(urls)). \
+                         filter(Event.user_id == self.ctx.redmine_user.id).filter(Event.created == now))
+        if len(url_to_id) != len(rows):
+            raise Exception("found {} of {} inserted events by url".format(len(url_to_id), len(rows)))
+        self._insert_categories((url_to_id[values["url"]], categories) for values, categories in inserts)
+        self.ctx.count_on_commit("events_inserted", len(rows))
+        logg.debug("inserted %s events", len(rows))
+
+    @metrics.timed("flush")
+    def _flush_updates(self):
+        updates, self._updates = self._updates, []
+        if not updates:
+            return
+        session = self.ctx.session
+        now = datetime.utcnow()
+        rows = [dict(values, modified=now) for values, _ in updates]
+        session.bulk_update_mappings(Event, rows)
+        event_ids = [row["id"] for row in rows]
+        session.execute(categories_events.delete().where(categories_events.c.event_id.in_(event_ids)))
+        self._insert_categories((values["id"], categories) for values, categories in updates)
+        self.ctx.count_on_commit("events_updated", len(rows))
+        logg.debug("updated %s events", len(rows))
+
+
+def _write_event(ctx, issue, url, writer=None, event=None):
+    """Create a new event or update `event` from `issue`.
+    Updates are skipped if the fingerprint of the mapped values didn't change since the last write.
+    
+    :returns: False if the project for the issue isn't mapped, True otherwise.
+    """
+    with metrics.timer("mapping"):
+        values, categories = _event_values(ctx, issue, url)
+        if values is None:
+            logg.warn("don't create event for unmapped project %s (issue #%s)", issue.project.id, issue.id)
+            metrics.incr("events_unmapped")
+            return False
+        fingerprint = event_fingerprint(values, categories)
+        if event is not None and ctx.fingerprints.get(url) == fingerprint:
+            logg.debug("content of event for issue #%s unchanged, skipping update", issue.id)
+            metrics.incr("events_skipped")
+            ctx.remember_version(url, issue.updated_on)
+            return True
+    # writes are counted on commit
+    if writer is None:
+        new_event = _apply_event_values(values, categories, event)
+        if event is None:
+            ctx.session.add(new_event)
+        ctx.count_on_commit("events_inserted" if event is None else "events_updated")
+    elif event is None:
+        writer.insert(values, categories)
+    else:
+        writer.update(event, values, categories)
+    ctx.remember_fingerprint(url, fingerprint)
+    ctx.remember_version(url, issue.updated_on)
+    return True
+
+
+def _update_existing_event(ctx, last_update_dt, urls_to_issues, event, writer=None, check_modified=True):
     assert isinstance(event, Event)
     url = event.url
     issue = urls_to_issues.get(url)
@@ -115,8 +416,8 @@ def _update_existing_event(last_update_dt, urls_to_issues, event):
         logg.warn("issue for event %s not found!", event.title)
         return
     
-    if event.status == status_confirmed:
-        if event.modified > last_update_dt:
+    if event.status == ctx.status_confirmed:
+        if check_modified and event.modified > last_update_dt:
             logg.warn("oops, event '%s' was updated in ELSAEvent (%s > %s), this should not happen!", event.title, 
                       datetime.strftime(event.modified, REDMINE_DATETIME_FORMAT), 
                       datetime.strftime(last_update_dt, REDMINE_DATETIME_FORMAT))
@@ -127,8 +428,9 @@ def _update_existing_event(last_update_dt, urls_to_issues, event):
             if issue.status.name == "Abgesagt":
                 logg.info("last event was cancelled")
             try:
-                event = create_or_update_event_from_issue(issue, url, event)
+                _write_event(ctx, issue, url, writer, event)
             except Exception as e:
+                metrics.incr("events_failed")
                 logg.exception("error occured for issue #%s: %s", issue.id, e)
         else:
             logg.debug("unchanged confirmed event #%s", issue.id)
@@ -137,48 +439,347 @@ def _update_existing_event(last_update_dt, urls_to_issues, event):
     del urls_to_issues[url]
 
 
-def update_event_database(redmine_issues, last_update_dt, start_dt=None, end_dt=None):
-    """Updates ELSAEvent database with some event issues.
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def iter_matching_events(ctx, urls, start_dt=None, end_dt=None, chunk_size=MATCH_CHUNK_SIZE):
+    """Generator for confirmed or cancelled events created by the Redmine user which have one of the given urls.
     Ignore events with a start datetime outside of ]start_dt, end_dt[.
-    
-    :param redmine_issues: activeResource objects which represent events.
-    :param last_update_dt: datetime for last DB update.
-    :param start_dt: start of datetime interval
-    :param end_dt: end of datetime interval
+    The urls are queried in chunks of `chunk_size`, so the IN clause stays small
+    and only one chunk of events is loaded at once.
     """
-    
-    # map REST url for issue to issue object
-    urls_to_issues = {URL_PATTERN + str(issue.id) : issue for issue in redmine_issues}
-#    logg.debug("created urls %s", urls_to_issues.keys())
-    filter_expr = Event.url.in_(list(urls_to_issues.keys()))
+    base_query = ctx.query(Event).filter(Event.status_id.in_([ctx.status_confirmed.id, ctx.status_cancelled.id])). \
+                filter_by(user_id=ctx.redmine_user.id)
     if start_dt and end_dt:
-        filter_expr = and_(filter_expr, Event.startdate.between(start_dt, end_dt))
+        base_query = base_query.filter(Event.startdate.between(start_dt, end_dt))
     elif not start_dt and end_dt:
-        filter_expr = and_(filter_expr, Event.startdate < end_dt)
+        base_query = base_query.filter(Event.startdate < end_dt)
     elif start_dt and not end_dt:
-        filter_expr = and_(filter_expr, Event.startdate > start_dt)
-    events = event_query.filter(Event.status_id.in_([status_confirmed.id, status_cancelled.id])). \
-                filter_by(user=redmine_user).filter(filter_expr).all()
-    logg.info("%s matching events in ELSAEvent DB", len(events))
-    now = datetime.utcnow()
-    for event in events:
-        _update_existing_event(last_update_dt, urls_to_issues, event)
+        base_query = base_query.filter(Event.startdate > start_dt)
+    for url_chunk in _chunks(urls, chunk_size):
+        for event in base_query.filter(Event.url.in_(url_chunk)).all():
+            yield event
+
+
+def _update_event_batch(ctx, redmine_issues, last_update_dt, start_dt, end_dt, writer, check_modified=True):
+    """Match issues to existing events, update them and create the missing ones. Doesn't commit."""
+    # map REST url for issue to issue object
+    urls_to_issues = {URL_PATTERN + str(issue.id) : issue for issue in redmine_issues}
+#    logg.debug("created urls %s", urls_to_issues.keys())
+    matched = 0
+    for event in iter_matching_events(ctx, list(urls_to_issues.keys()), start_dt, end_dt):
+        matched += 1
+        _update_existing_event(ctx, last_update_dt, urls_to_issues, event, writer, check_modified)
+        # outside of the per-issue error handling, a failed write fails the batch
+        if writer is not None:
+            writer.flush_full()
+    logg.info("%s matching events in ELSAEvent DB", matched)
         
     # remaining issues in urls_to_issues are new, insert them
     logg.info("%s new events found", len(urls_to_issues))
     for url, issue in urls_to_issues.items():
         try:
-            event = create_or_update_event_from_issue(issue, url)
+            created = _write_event(ctx, issue, url, writer)
         except Exception as e:
+            metrics.incr("events_failed")
             logg.exception("error occured for issue #%s: %s", issue.id, e)
         else:
-            if event is None:
+            if not created:
                 logg.warn("no event was created for %s from issue #%s", issue.subject, issue.id)
             else:
                 logg.info("created new event '%s' from issue #%s", issue.subject, issue.id)
-                esession.add(event)
+        if writer is not None:
+            writer.flush_full()
         
-    esession.commit()
+    if writer is not None:
+        writer.flush()
+
+
+def update_event_database(redmine_issues, last_update_dt, start_dt=None, end_dt=None, context=None, bulk=False):
+    """Updates ELSAEvent database with some event issues.
+    Ignore events with a start datetime outside of ]start_dt, end_dt[.
+    
+    :param redmine_issues: activeResource objects which represent events.
+    :param last_update_dt: datetime for last DB update.
+    :param start_dt: start of datetime interval
+    :param end_dt: end of datetime interval
+    :param context: SyncContext to use, default context if None.
+    :param bulk: write events in batches with a BulkEventWriter instead of single ORM flushes.
+    """
+    ctx = context or get_context()
+    ctx.refresh_categories()
+    writer = BulkEventWriter(ctx) if bulk else None
+    now = datetime.utcnow()
+    try:
+        _update_event_batch(ctx, redmine_issues, last_update_dt, start_dt, end_dt, writer)
+        ctx.commit()
+    except:
+        ctx.rollback()
+        raise
     return now
-        
-        
\ No newline at end of file
+
+
+def sync_issues(redmine_issues, context=None):
+    """Create or update the events for some issues, regardless of their update time.
+    Used for targeted syncs of single issues, for example after a webhook notification.
+    Events which were cancelled are left alone like in :func:`update_event_database`,
+    events whose content didn't change aren't written.
+    
+    :param redmine_issues: issues which represent events, as resource objects or records.
+    :param context: SyncContext to use, default context if None.
+    :returns: number of issues which are in sync with their events now.
+    """
+    ctx = context or get_context()
+    urls_to_issues = {URL_PATTERN + str(issue.id): issue for issue in redmine_issues}
+    events = {event.url: event for event in iter_matching_events(ctx, list(urls_to_issues.keys()))}
+    synced = 0
+    for url, issue in urls_to_issues.items():
+        event = events.get(url)
+        if event is not None and event.status != ctx.status_confirmed:
+            logg.debug("skipping already cancelled event #%s", issue.id)
+            continue
+        try:
+            if _write_event(ctx, issue, url, event=event):
+                synced += 1
+        except Exception as e:
+            metrics.incr("events_failed")
+            logg.exception("error occured for issue #%s: %s", issue.id, e)
+    ctx.commit()
+    logg.info("targeted sync of %s issues, %s synced", len(urls_to_issues), synced)
+    return synced
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+
+def sync_issues_by_id(issue_ids, context=None, batch_size=SYNC_BATCH_SIZE):
+    """Fetch the event issues with the given ids and sync them with :func:`sync_issues`,
+    one transaction per batch of `batch_size` issues.
+    Ids which don't belong to a syncable event issue are reported and skipped.
+    
+    :param issue_ids: iterable of Redmine issue ids
+    :returns: set of ids which were not synced.
+    """
+    ctx = context or get_context()
+    issue_ids = set(issue_ids)
+    ctx.refresh_categories()
+    seen = set()
+    synced = 0
+    for batch in _batches(get_event_issues_by_id(issue_ids, records=True), batch_size):
+        seen.update(issue.id for issue in batch)
+        synced += sync_issues([issue for issue in batch if is_syncable_issue(issue)], ctx)
+    missing = issue_ids - seen
+    if missing:
+        logg.warn("issues %s not found or not event issues", ", ".join(map(str, sorted(missing))))
+    logg.info("synced %s of %s requested issues", synced, len(issue_ids))
+    return missing
+
+
+def sync_event_issues(redmine_issues, last_update_dt, start_dt=None, end_dt=None, context=None, bulk=False,
+                      batch_size=SYNC_BATCH_SIZE, on_batch_committed=None, check_modified=True):
+    """Streaming variant of :func:`update_event_database`.
+    Issues are pulled from `redmine_issues` (usually a generator from :func:`get_event_issues`)
+    in batches of `batch_size`. Every batch is matched, written and committed before the next one
+    is requested, so memory usage depends on the batch size, not on the number of issues.
+    
+    :param batch_size: number of issues per batch and transaction.
+    :param on_batch_committed: function called with the list of issues after each commit, for checkpointing.
+    :param check_modified: warn about confirmed events which were modified in ELSAEvent after `last_update_dt`.
+        Turn it off when syncing a window again, the events were modified by earlier syncs.
+    :returns: datetime when the sync started, use it as `last_update_dt` for the next sync.
+    """
+    ctx = context or get_context()
+    now = datetime.utcnow()
+    ctx.refresh_categories()
+    for batch_no, batch in enumerate(_batches(redmine_issues, batch_size), 1):
+        logg.debug("syncing batch %s with %s issues", batch_no, len(batch))
+        writer = BulkEventWriter(ctx) if bulk else None
+        try:
+            _update_event_batch(ctx, batch, last_update_dt, start_dt, end_dt, writer, check_modified)
+            ctx.commit()
+        except:
+            # the context is reused by later syncs, it must not keep anything from the failed batch
+            ctx.rollback()
+            raise
+        if on_batch_committed is not None:
+            on_batch_committed(batch)
+    return now
+
+
+def _sync_partition(project_mappings, fingerprints, stopped, key, issues, last_update_dt, start_dt, end_dt, bulk, 
+                    batch_size, on_batch_committed):
+    """Sync one partition in its own session, returns the exception if the partition failed.
+    Raises SyncStopped if the sync was stopped, `stopped` is a threading.Event shared by the partitions.
+    """
+    if stopped.is_set():
+        raise SyncStopped("sync stopped before partition {}".format(key))
+
+    def batch_committed(batch):
+        if on_batch_committed is not None:
+            on_batch_committed(batch)
+        # another partition was stopped, stop this one after the committed batch, too
+        if stopped.is_set():
+            raise SyncStopped("sync stopped in partition {}".format(key))
+    worker_ctx = SyncContext(elsaevent.new_session(), project_mappings, fingerprints)
+    try:
+        sync_event_issues(issues, last_update_dt, start_dt, end_dt, worker_ctx, bulk, batch_size, batch_committed)
+    except SyncStopped:
+        stopped.set()
+        raise
+    except Exception as e:
+        logg.exception("sync failed for partition %s: %s", key, e)
+        worker_ctx.session.rollback()
+        return e
+    finally:
+        worker_ctx.session.close()
+    return None
+
+
+def sync_event_issues_partitioned(redmine_issues, last_update_dt, start_dt=None, end_dt=None, context=None, 
+                                  bulk=False, batch_size=SYNC_BATCH_SIZE, on_batch_committed=None,
+                                  partition_by="project", workers=SYNC_WORKERS):
+    """Like :func:`sync_event_issues`, but issues are partitioned by Redmine project or ELSAEvent group
+    and the partitions are synced in parallel by `workers` threads.
+    Every partition uses its own session and transactions, a failing partition doesn't affect the others.
+    All issues are read into memory before the partitions are synced, unlike :func:`sync_event_issues`.
+    If `on_batch_committed` raises SyncStopped, partitions which didn't start yet are cancelled,
+    the running ones stop at their next batch and SyncStopped is raised again.
+    
+    :param partition_by: "project" or "group"
+    :param workers: number of partitions synced in parallel.
+    :returns: (datetime when the sync started, dict partition key -> exception for failed partitions)
+    """
+    ctx = context or get_context()
+    now = datetime.utcnow()
+    # resolved here, the workers only read them
+    project_mappings = ctx.project_mappings
+    fingerprints = ctx.fingerprints
+    if partition_by == "project":
+        partition_key = lambda issue: issue.project.id
+    elif partition_by == "group":
+        partition_key = lambda issue: project_mappings.get(issue.project.id)
+    else:
+        raise ValueError("partition_by must be 'project' or 'group'")
+    partitions = {}
+    for issue in redmine_issues:
+        partitions.setdefault(partition_key(issue), []).append(issue)
+    logg.info("syncing %s partitions by %s with %s workers", len(partitions), partition_by, workers)
+    
+    failed = {}
+    stopped = threading.Event()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_sync_partition, project_mappings, fingerprints, stopped, key, issues, 
+                                   last_update_dt, start_dt, end_dt, bulk, batch_size, on_batch_committed): key 
+                   for key, issues in partitions.items()}
+        try:
+            for future in as_completed(futures):
+                error = future.result()
+                if error is not None:
+                    failed[futures[future]] = error
+        except SyncStopped:
+            for future in futures:
+                future.cancel()
+            raise
+    return now, failed
+
+
+# sets of issue ids, and ids of orphaned events (their issue is gone or not synced anymore)
+ReconcileResult = namedtuple("ReconcileResult", "missing outdated orphans unsynced")
+
+
+def _issue_id_from_url(url):
+    if url and url.startswith(URL_PATTERN):
+        issue_id = url[len(URL_PATTERN):]
+        if issue_id.isdigit():
+            return int(issue_id)
+    return None
+
+
+def iter_event_stamps(ctx, chunk_size=MATCH_CHUNK_SIZE):
+    """Generator for (event id, issue id, status id, modified, group id) of all events created by the Redmine user.
+    The issue id is None if the event url doesn't point to a Redmine issue.
+    """
+    query = ctx.query(Event.id, Event.url, Event.status_id, Event.modified, Event.group_id). \
+        filter_by(user_id=ctx.redmine_user.id).order_by(Event.id).yield_per(chunk_size)
+    for event_id, url, status_id, modified, group_id in query:
+        yield event_id, _issue_id_from_url(url), status_id, modified, group_id
+
+
+def delete_events(ctx, event_ids, chunk_size=MATCH_CHUNK_SIZE):
+    """Delete events and the rows referring to them. Doesn't commit."""
+    event_ids = list(event_ids)
+    for chunk in _chunks(event_ids, chunk_size):
+        for table in (categories_events, EventsNotification.__table__, EventsUser.__table__):
+            ctx.session.execute(table.delete().where(table.c.event_id.in_(chunk)))
+        ctx.session.execute(Event.__table__.delete().where(Event.__table__.c.id.in_(chunk)))
+
+
+def reconcile(context=None, delete_orphans=True, dry_run=False):
+    """Compare all event issues in Redmine with all events of the Redmine user in ELSAEvent.
+    Only (id, updated_on) stamps are compared, full issues are fetched just for the differences:
+    
+    * missing: syncable issue without event, the event is created
+    * outdated: issue was updated after the version synced to its confirmed event, the event is updated.
+      Events synced before versions were recorded are compared by their modification time.
+    * orphans: event for an issue which was deleted, moved to an unmapped project or to another tracker,
+      and duplicate events for the same issue. They are deleted if `delete_orphans` is True.
+      Events in the group of a mapping whose project couldn't be resolved are kept,
+      their issues can't be told apart from deleted ones.
+    
+    :param dry_run: only compute the differences, don't change anything.
+    :returns: ReconcileResult, `unsynced` are the ids from `missing` and `outdated` which couldn't be synced.
+    """
+    ctx = context or get_context()
+    # issue id -> updated_on for issues which should have an event
+    wanted = {}
+    # all event issues in mapped projects, their events are legitimate even if the issue isn't synced
+    known = set()
+    for stamp in get_event_issue_stamps():
+        if stamp.project_id in ctx.project_mappings:
+            known.add(stamp.id)
+            if stamp.status not in UNSYNCED_STATUSES:
+                wanted[stamp.id] = stamp.updated_on
+    
+    # url -> updated_on of the issue synced last to the event
+    versions = ctx.fingerprints.versions()
+    # issue id -> (status id, synced version) of the first event for an issue
+    events = {}
+    orphans = []
+    kept = 0
+    for event_id, issue_id, status_id, modified, group_id in iter_event_stamps(ctx):
+        if issue_id is not None and issue_id not in known and group_id in ctx.unresolved_groups:
+            kept += 1
+        elif issue_id is None or issue_id not in known or issue_id in events:
+            orphans.append(event_id)
+        else:
+            events[issue_id] = (status_id, versions.get(URL_PATTERN + str(issue_id), modified))
+    if kept:
+        logg.warn("reconcile: keeping %s events of groups whose project couldn't be resolved", kept)
+    
+    missing = wanted.keys() - events.keys()
+    confirmed_id = ctx.status_confirmed.id
+    outdated = {issue_id for issue_id in wanted.keys() & events.keys() 
+                if events[issue_id][0] == confirmed_id and wanted[issue_id] is not None 
+                and (events[issue_id][1] is None or wanted[issue_id] > events[issue_id][1])}
+    logg.info("reconcile: %s issues, %s events, %s missing, %s outdated, %s orphaned events", 
+              len(wanted), len(events) + len(orphans), len(missing), len(outdated), len(orphans))
+    if dry_run:
+        return ReconcileResult(missing, outdated, orphans, set())
+    
+    unsynced = sync_issues_by_id(missing | outdated, ctx) if missing or outdated else set()
+    if orphans and delete_orphans:
+        if len(orphans) > RECONCILE_MAX_ORPHAN_RATIO * (len(events) + len(orphans)):
+            logg.error("reconcile: %s of %s events would be deleted, refusing. Check the project mappings!", 
+                       len(orphans), len(events) + len(orphans))
+            return ReconcileResult(missing, outdated, orphans, unsynced)
+        delete_events(ctx, orphans)
+        ctx.commit()
+        logg.info("deleted %s orphaned events", len(orphans))
+    return ReconcileResult(missing, outdated, orphans, unsynced)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+'''
+eventsync.scheduler.py
+
+asyncio scheduler for sync jobs. Every job runs on a fixed cadence which doesn't drift with the job duration.
+Ticks which are missed because a run took too long are coalesced into one run, jobs never overlap.
+The sync functions are blocking, they are run in a thread.
+'''
+import asyncio
+import logging
+
+logg = logging.getLogger(__name__)
+
+
+class Job(object):
+    """Function `func` which is run every `interval` seconds.
+
+    :param first_delay: seconds until the first run, 0 runs the job when the scheduler starts.
+    """
+    def __init__(self, name, interval, func, first_delay=0):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.first_delay = first_delay
+        self.runs = 0
+        self.skipped = 0
+        self.failures = 0
+
+    def __repr__(self):
+        return "Job({!r}, every {}s)".format(self.name, self.interval)
+
+
+class SyncScheduler(object):
+    """Runs jobs at their cadences until :meth:`stop` is called.
+    All jobs share one lock because they write to the same databases, so at most one job runs at a time.
+    A job which becomes due while another one is running waits for it; the missed ticks are skipped.
+    """
+    def __init__(self):
+        self.jobs = []
+        self._stopping = None
+        self._lock = None
+
+    def add_job(self, name, interval, func, first_delay=0):
+        job = Job(name, interval, func, first_delay)
+        self.jobs.append(job)
+        return job
+
+    def stop(self):
+        """Request shutdown. Running jobs are finished, no new ones are started."""
+        if self._stopping is not None and not self._stopping.is_set():
+            logg.info("stopping scheduler")
+            self._stopping.set()
+
+    def _setup(self):
+        # asyncio objects must be created in the running loop
+        if self._lock is None:
+            self._stopping = asyncio.Event()
+            self._lock = asyncio.Lock()
+
+    async def _sleep_until(self, deadline):
+        """Sleep until `deadline` (loop time), returns False if the scheduler was stopped in the meantime."""
+        timeout = deadline - asyncio.get_running_loop().time()
+        try:
+            await asyncio.wait_for(self._stopping.wait(), max(timeout, 0))
+        except asyncio.TimeoutError:
+            return True
+        return False
+
+    async def _run(self, job):
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            if self._stopping.is_set():
+                return
+            logg.info("running job %s", job.name)
+            started = loop.time()
+            try:
+                await loop.run_in_executor(None, job.func)
+            except Exception:
+                job.failures += 1
+                logg.exception("job %s failed", job.name)
+            job.runs += 1
+            logg.info("job %s finished in %.1fs", job.name, loop.time() - started)
+
+    async def run_once(self, name, func):
+        """Run `func` once as soon as no other job is running, for example triggered by a notification."""
+        self._setup()
+        await self._run(Job(name, None, func))
+
+    async def _job_loop(self, job):
+        loop = asyncio.get_running_loop()
+        next_run = loop.time() + job.first_delay
+        while await self._sleep_until(next_run):
+            await self._run(job)
+            # stay on the fixed grid, ticks which passed during the run are coalesced
+            next_run += job.interval
+            now = loop.time()
+            if next_run <= now:
+                missed = int((now - next_run) // job.interval) + 1
+                job.skipped += missed
+                next_run += missed * job.interval
+                logg.warn("job %s overran its interval, skipping %s runs", job.name, missed)
+
+    async def run(self):
+        """Run all jobs until :meth:`stop` is called, then wait for the running job."""
+        self._setup()
+        logg.info("starting scheduler with jobs %s", self.jobs)
+        await asyncio.gather(*(self._job_loop(job) for job in self.jobs))
+        logg.info("scheduler stopped")
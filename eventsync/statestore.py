@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+'''
+eventsync.statestore.py
+
+Durable sync state in a SQLite database (WAL mode): the update watermark, the last seen version
+of every synced issue, a history of sync runs and the issues created from event templates.
+Every batch is checkpointed after it was committed to ELSAEvent, so an interrupted run can be resumed.
+The two databases are committed separately: after a crash between the commits the batch is synced again,
+that's harmless because unchanged events are skipped by their fingerprints.
+'''
+from contextlib import contextmanager
+from datetime import date, datetime
+import logging
+import os
+import shelve
+import sqlite3
+import threading
+
+logg = logging.getLogger(__name__)
+
+STATE_FILENAME = "eventsync.sqlite"
+GLOBAL_SCOPE = "global"
+# a failed run is resumed until it failed this many times, then it's abandoned and a new window is started
+MAX_RUN_FAILURES = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS watermarks (
+    scope TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS issues (
+    issue_id INTEGER PRIMARY KEY,
+    project_id INTEGER,
+    tracker_id INTEGER,
+    updated_on TEXT,
+    last_seen TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started TEXT NOT NULL,
+    finished TEXT,
+    status TEXT NOT NULL,
+    window_start TEXT,
+    window_end TEXT,
+    batches INTEGER NOT NULL DEFAULT 0,
+    issues INTEGER NOT NULL DEFAULT 0,
+    duration REAL,
+    error TEXT,
+    failures INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS run_issues (
+    run_id INTEGER NOT NULL,
+    issue_id INTEGER NOT NULL,
+    updated_on TEXT,
+    PRIMARY KEY (run_id, issue_id)
+);
+CREATE TABLE IF NOT EXISTS template_occurrences (
+    template_id INTEGER NOT NULL,
+    occurrence_date TEXT NOT NULL,
+    issue_id INTEGER,
+    created TEXT NOT NULL,
+    PRIMARY KEY (template_id, occurrence_date)
+);
+"""
+
+
+def _to_str(dt):
+    return dt.isoformat() if dt is not None else None
+
+
+def _to_datetime(value):
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+class SyncStateStore(object):
+    """Sync state in a SQLite database, safe to use from several threads and processes.
+
+    :param filename: database file
+    """
+    def __init__(self, filename=STATE_FILENAME):
+        self.filename = filename
+        self._db = None
+        self._lock = threading.RLock()
+
+    def _open(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.filename, timeout=30, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(_SCHEMA)
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(runs)")}
+            if "failures" not in columns:
+                self._db.execute("ALTER TABLE runs ADD COLUMN failures INTEGER NOT NULL DEFAULT 0")
+        return self._db
+
+    @contextmanager
+    def _transaction(self):
+        """Exclusive write transaction, committed on success and rolled back on errors."""
+        with self._lock:
+            db = self._open()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except:
+                db.execute("ROLLBACK")
+                raise
+            else:
+                db.execute("COMMIT")
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._open().execute(sql, params).fetchall()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    # watermarks
+
+    def get_watermark(self, scope=GLOBAL_SCOPE):
+        """datetime of the last update for `scope`, None if unknown."""
+        rows = self._query("SELECT value FROM watermarks WHERE scope = ?", (scope,))
+        return _to_datetime(rows[0][0]) if rows else None
+
+    def set_watermark(self, dt, scope=GLOBAL_SCOPE):
+        with self._transaction() as db:
+            db.execute("INSERT OR REPLACE INTO watermarks VALUES (?, ?)", (scope, _to_str(dt)))
+
+    def import_shelve(self, filename="eventsync.shelve"):
+        """Take over last_updated from the old shelve checkpoint if we don't have a watermark yet."""
+        if self.get_watermark() is not None:
+            return False
+        if not any(os.path.exists(f) for f in (filename, filename + ".db", filename + ".dat")):
+            return False
+        shv = shelve.open(filename, flag="r")
+        try:
+            last_updated = shv.get("last_updated")
+        finally:
+            shv.close()
+        if last_updated is None:
+            return False
+        logg.info("importing last update time %s from %s", last_updated, filename)
+        self.set_watermark(last_updated)
+        return True
+
+    # runs
+
+    def start_run(self, window_start, window_end):
+        """Record a new sync run for the update window ]window_start, window_end[, returns the run id."""
+        with self._transaction() as db:
+            cursor = db.execute("INSERT INTO runs (started, status, window_start, window_end) VALUES (?, ?, ?, ?)",
+                                (_to_str(datetime.utcnow()), "running", _to_str(window_start), _to_str(window_end)))
+            return cursor.lastrowid
+
+    def unfinished_run(self, max_failures=MAX_RUN_FAILURES):
+        """The last run if it was interrupted or failed, as (run id, window start, window end), else None.
+        A run which failed `max_failures` times is abandoned instead of resuming it again, so a permanent
+        error doesn't freeze the end of the update window. The global watermark isn't moved by failed runs,
+        the window of the next run starts there and covers the issues of the abandoned run.
+        """
+        with self._transaction() as db:
+            row = db.execute("SELECT id, status, window_start, window_end, failures FROM runs "
+                             "ORDER BY id DESC LIMIT 1").fetchone()
+            if row is None or row[1] in ("ok", "abandoned"):
+                return None
+            run_id, _, window_start, window_end, failures = row
+            if failures >= max_failures:
+                logg.warn("sync run %s failed %s times, abandoning it and starting a new window", run_id, failures)
+                db.execute("UPDATE runs SET status = 'abandoned' WHERE id = ?", (run_id,))
+                return None
+        return run_id, _to_datetime(window_start), _to_datetime(window_end)
+
+    def committed_issues(self, run_id):
+        """dict issue id -> updated_on of issues which were committed by run `run_id`."""
+        rows = self._query("SELECT issue_id, updated_on FROM run_issues WHERE run_id = ?", (run_id,))
+        return {issue_id: _to_datetime(updated_on) for issue_id, updated_on in rows}
+
+    def checkpoint(self, run_id, issues):
+        """Record a batch of issues which was committed to ELSAEvent by run `run_id`.
+        Issue versions and the progress of the run are updated in one transaction.
+        """
+        now = _to_str(datetime.utcnow())
+        rows = []
+        for issue in issues:
+            project_id = issue.project.id if issue.project else None
+            tracker_id = issue.tracker.id if issue.tracker else None
+            rows.append((issue.id, project_id, tracker_id, _to_str(issue.updated_on), now))
+        with self._transaction() as db:
+            db.executemany("INSERT OR REPLACE INTO issues VALUES (?, ?, ?, ?, ?)", rows)
+            db.executemany("INSERT OR REPLACE INTO run_issues VALUES (?, ?, ?)",
+                           [(run_id, row[0], row[3]) for row in rows])
+            db.execute("UPDATE runs SET batches = batches + 1, issues = issues + ? WHERE id = ?", (len(rows), run_id))
+
+    def finish_run(self, run_id, status="ok", error=None):
+        """Close run `run_id`. A successful run moves the global watermark to the start time of the run,
+        failures are counted for :meth:`unfinished_run`.
+        """
+        with self._transaction() as db:
+            started, = db.execute("SELECT started FROM runs WHERE id = ?", (run_id,)).fetchone()
+            finished = datetime.utcnow()
+            duration = (finished - _to_datetime(started)).total_seconds()
+            db.execute("UPDATE runs SET finished = ?, status = ?, duration = ?, error = ?, "
+                       "failures = failures + ? WHERE id = ?",
+                       (_to_str(finished), status, duration, error, int(status == "failed"), run_id))
+            if status == "ok":
+                db.execute("INSERT OR REPLACE INTO watermarks VALUES (?, ?)", (GLOBAL_SCOPE, started))
+                db.execute("DELETE FROM run_issues WHERE run_id <= ?", (run_id,))
+
+    def last_runs(self, limit=10):
+        """History of the last runs as list of dicts, newest first."""
+        rows = self._query("SELECT id, started, finished, status, batches, issues, duration, error, failures "
+                           "FROM runs ORDER BY id DESC LIMIT ?", (limit,))
+        keys = ("id", "started", "finished", "status", "batches", "issues", "duration", "error", "failures")
+        return [dict(zip(keys, row)) for row in rows]
+
+    # template occurrences
+
+    def template_occurrences(self, template_id, start, end):
+        """Dates in [start, end] for which an issue was already created from template `template_id`."""
+        rows = self._query("SELECT occurrence_date FROM template_occurrences WHERE template_id = ? "
+                           "AND occurrence_date BETWEEN ? AND ?", (template_id, start.isoformat(), end.isoformat()))
+        return {date.fromisoformat(row[0]) for row in rows}
+
+    def record_template_occurrences(self, occurrences):
+        """Remember created issues, `occurrences` is an iterable of (template id, occurrence date, issue id)."""
+        now = _to_str(datetime.utcnow())
+        with self._transaction() as db:
+            db.executemany("INSERT OR REPLACE INTO template_occurrences VALUES (?, ?, ?, ?)",
+                           [(template_id, occurrence_date.isoformat(), issue_id, now)
+                            for template_id, occurrence_date, issue_id in occurrences])
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+'''
+eventsync.webhook.py
+
+Small asyncio HTTP listener for issue change notifications.
+Accepts POST requests from the Redmine webhook plugin ({"payload": {"issue": {"id": 123, ...}}})
+or simple pings like {"issue_ids": [1, 2]}, {"issue_id": 1} or ?issue_id=1,2.
+Notifications are debounced: ids are collected until no new one arrived for `debounce` seconds
+(at most `max_delay` seconds), then the callback is called once with all of them.
+If a Metrics object is given, GET /metrics returns its values in the Prometheus text format.
+'''
+import asyncio
+import hmac
+import json
+import logging
+from urllib.parse import urlparse, parse_qs
+
+logg = logging.getLogger(__name__)
+
+WEBHOOK_DEBOUNCE = 2.0
+WEBHOOK_MAX_DELAY = 10.0
+# larger request bodies are rejected
+WEBHOOK_MAX_BODY = 1024 * 1024
+
+_REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 403: "Forbidden", 405: "Method Not Allowed",
+            413: "Payload Too Large"}
+
+
+def parse_issue_ids(path, body):
+    """Issue ids from the query string and the JSON body of a notification.
+    Raises ValueError for malformed notifications.
+    """
+    issue_ids = set()
+    for value in parse_qs(urlparse(path).query).get("issue_id", []):
+        issue_ids.update(int(i) for i in value.split(","))
+    if body:
+        data = json.loads(body.decode("utf-8"))
+        if not isinstance(data, dict):
+            raise ValueError("notification must be a JSON object")
+        # redmine_webhook plugin format
+        issue = (data.get("payload") or {}).get("issue")
+        if issue:
+            issue_ids.add(int(issue["id"]))
+        if "issue_id" in data:
+            issue_ids.add(int(data["issue_id"]))
+        issue_ids.update(int(i) for i in data.get("issue_ids", []))
+    return issue_ids
+
+
+class WebhookListener(object):
+    """HTTP listener which calls the coroutine function `on_issues` with a set of changed issue ids.
+
+    :param token: if given, requests must send it in the X-Webhook-Token header or as ?token=...
+    :param metrics: :class:`eventsync.metrics.Metrics` served at GET /metrics (without token), None disables it.
+    """
+    def __init__(self, on_issues, host="127.0.0.1", port=8080, token=None,
+                 debounce=WEBHOOK_DEBOUNCE, max_delay=WEBHOOK_MAX_DELAY, metrics=None):
+        self.on_issues = on_issues
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.token = token
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._server = None
+        self._pending = set()
+        self._first_pending = None
+        self._timer = None
+        self._flushes = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logg.info("webhook listener on %s:%s", self.host, self.port)
+
+    async def stop(self):
+        """Close the listener and wait for running syncs.
+        Pending notifications are dropped, the next polling sync picks up these issues.
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._pending:
+            logg.info("dropping notifications for issues %s", sorted(self._pending))
+            self._pending.clear()
+        if self._flushes:
+            await asyncio.gather(*self._flushes)
+
+    def notify(self, issue_ids):
+        """Schedule a sync for `issue_ids`, restarting the debounce timer."""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if not self._pending:
+            self._first_pending = now
+        self._pending.update(issue_ids)
+        if self._timer is not None:
+            self._timer.cancel()
+        delay = min(self.debounce, self._first_pending + self.max_delay - now)
+        self._timer = loop.call_later(max(delay, 0), self._flush)
+
+    def _flush(self):
+        self._timer = None
+        if not self._pending:
+            return
+        issue_ids, self._pending = self._pending, set()
+        logg.info("syncing %s notified issues", len(issue_ids))
+        task = asyncio.ensure_future(self._call(issue_ids))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _call(self, issue_ids):
+        try:
+            await self.on_issues(issue_ids)
+        except Exception:
+            logg.exception("sync of notified issues %s failed", sorted(issue_ids))
+
+    def _authorized(self, path, headers):
+        if self.token is None:
+            return True
+        given = headers.get("x-webhook-token") or parse_qs(urlparse(path).query).get("token", [""])[0]
+        return hmac.compare_digest(given.encode("utf-8"), self.token.encode("utf-8"))
+
+    async def _respond(self, writer, status, content=None, content_type="application/json"):
+        if isinstance(content, str):
+            body = content.encode("utf-8")
+        else:
+            body = json.dumps(content if content is not None else {"status": _REASONS[status]}).encode("utf-8")
+        writer.write("HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n"
+                     "Connection: close\r\n\r\n".format(status, _REASONS[status], content_type, 
+                                                          len(body)).encode("ascii") + body)
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1")
+                if line in ("\r\n", "\n", ""):
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if len(request_line) != 3:
+                return await self._respond(writer, 400)
+            method, path, _ = request_line
+            if method == "GET" and self.metrics is not None and urlparse(path).path == "/metrics":
+                return await self._respond(writer, 200, self.metrics.prometheus_text(), 
+                                           "text/plain; version=0.0.4")
+            if method != "POST":
+                return await self._respond(writer, 405)
+            if not self._authorized(path, headers):
+                logg.warn("rejected webhook request without valid token")
+                return await self._respond(writer, 403)
+            length = int(headers.get("content-length", 0))
+            if length > WEBHOOK_MAX_BODY:
+                return await self._respond(writer, 413)
+            body = await reader.readexactly(length) if length else b""
+            try:
+                issue_ids = parse_issue_ids(path, body)
+            except (ValueError, KeyError, TypeError) as e:
+                logg.warn("malformed webhook notification: %s", e)
+                return await self._respond(writer, 400)
+            logg.debug("webhook notification for issues %s", sorted(issue_ids))
+            if issue_ids:
+                self.notify(issue_ids)
+            await self._respond(writer, 202, {"issue_ids": sorted(issue_ids)})
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            logg.debug("webhook connection failed: %s", e)
+        finally:
+            writer.close()
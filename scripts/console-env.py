@@ -26,8 +26,14 @@ q = s.query
 midnight_today = datetime.now() - relativedelta(hour=0, minute=0)
 midnight_yesterday = datetime.now() - relativedelta(days=1, hour=0, minute=0)
 midnight_tomorrow = datetime.now() - relativedelta(days=-1, hour=0, minute=0)
-iss_with_new = get_event_issues(False, midnight_yesterday, midnight_tomorrow)
-iss = list(filter(lambda i: not i.status.name == "Neu", iss_with_new))
+
+
+def recent_issues():
+    """Non-new event issues updated between yesterday and tomorrow"""
+    iss_with_new = get_event_issues(False, midnight_yesterday, midnight_tomorrow)
+    return list(filter(lambda i: not i.status.name == "Neu", iss_with_new))
+
+# iss = recent_issues()
 
 # i = Issue.find(532)
 # value = i.wiederholungsart
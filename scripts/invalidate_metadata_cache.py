@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+'''
+scripts.invalidate_metadata_cache.py
+
+Drop cached Redmine metadata (trackers, issue_statuses, projects).
+Without arguments, the whole cache is invalidated.
+'''
+import sys
+
+sys.path.append(".")
+
+from eventsync.redmine.metacache import metadata_cache
+
+resource_types = sys.argv[1:] or [None]
+for resource_type in resource_types:
+    metadata_cache.invalidate(resource_type)
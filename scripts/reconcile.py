@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+'''
+scripts.reconcile.py
+
+Compare all event issues with the events in ELSAEvent, sync missing / outdated events and delete orphaned ones.
+Usage: python scripts/reconcile.py [--dry-run] [--keep-orphans]
+'''
+import sys
+
+sys.path.append(".")
+
+import eventsync.logconfig
+import eventsync.redmine_elsa_sync as redmine_elsa_sync
+
+logg = eventsync.logconfig.configure_logging()
+
+result = redmine_elsa_sync.reconcile(delete_orphans="--keep-orphans" not in sys.argv, dry_run="--dry-run" in sys.argv)
+logg.info("missing: %s", sorted(result.missing))
+logg.info("outdated: %s", sorted(result.outdated))
+logg.info("orphaned events: %s", sorted(result.orphans))
+if result.unsynced:
+    logg.warn("not synced: %s", sorted(result.unsynced))
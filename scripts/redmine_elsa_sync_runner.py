@@ -4,47 +4,202 @@ scripts.redmine_elsa_sync_runner.py
 Created on 10.04.2013
 @author: tobixx0
 '''
-from datetime import datetime
-import shelve
+import asyncio
+from datetime import datetime, timedelta
+import json
+import signal
 import sys
-from time import sleep
+import threading
+import time
 
 sys.path.append(".")
 print(sys.path)
 
 import eventsync.redmine_elsa_sync as redmine_elsa_sync
 from eventsync.redmine.redmineapi import *
-from eventsync.redmine.issues import get_event_issues
+from eventsync.redmine.issues import get_event_issues, is_syncable_issue
 import eventsync.elsaevent
 from eventsync.elsaevent.datamodel import *
 from eventsync import runner_settings
+from eventsync.statestore import SyncStateStore
+from eventsync.scheduler import SyncScheduler
+from eventsync.webhook import WebhookListener
+from eventsync.materialiser import materialise_templates
+from eventsync.metrics import metrics
 
 import eventsync.logconfig
 logg = eventsync.logconfig.configure_logging(runner_settings.LOG_FILENAME, runner_settings.LOG_SMTP_SETTINGS)
 
-shv = shelve.open("eventsync.shelve")
+# sync projects in parallel if > 1
+sync_workers = getattr(runner_settings, "SYNC_WORKERS", 1)
+# write events with batched statements instead of single ORM flushes
+bulk_writes = getattr(runner_settings, "BULK_WRITES", False)
+state = SyncStateStore()
+state.import_shelve("eventsync.shelve")
+# set on shutdown, a running sync stops after the current batch
+shutdown = threading.Event()
+# Prometheus text file with the metrics, written after every run
+metrics_filename = getattr(runner_settings, "METRICS_FILENAME", None)
+
+
+class SyncInterrupted(redmine_elsa_sync.SyncStopped):
+    pass
+
+
+def _checkpoint(run_id):
+    def checkpoint(batch):
+        state.checkpoint(run_id, batch)
+        if shutdown.is_set():
+            raise SyncInterrupted("shutdown requested")
+    return checkpoint
+
 
 def do_sync():
-    last_updated = shv["last_updated"]
-    now = datetime.now()  
-    logg.debug("last update was %s", last_updated)
-    all_event_issues = get_event_issues(True, last_updated, now)
-    event_issues = list(filter(lambda i: i.status.name not in ["Abgeschlossen", "Neu"], all_event_issues))
-    start_dt = last_updated.replace(hour=0, minute=0, second=0, microsecond=0)
-    update_dt = eventsync.redmine_elsa_sync.update_event_database(event_issues, last_update_dt=last_updated, start_dt=start_dt)
-    logg.debug("update datetime is %s", update_dt)
-    shv["last_updated"] = update_dt
+    unfinished = state.unfinished_run()
+    if unfinished:
+        # an earlier run was interrupted or failed, sync its window again but skip issues it already committed
+        run_id, last_updated, now = unfinished
+        committed = state.committed_issues(run_id)
+        logg.info("resuming sync run %s, %s issues already committed", run_id, len(committed))
+    else:
+        last_updated = state.get_watermark()
+        if last_updated is None:
+            raise Exception("no last update time in {}, set it with scripts/set_last_update_time.py".format(
+                state.filename))
+        now = datetime.now()  
+        run_id = state.start_run(last_updated, now)
+        committed = {}
+    # every failure from here on must finish the run, so it's counted and can be abandoned
+    try:
+        logg.debug("last update was %s", last_updated)
+        all_event_issues = get_event_issues(True, last_updated, now, records=True)
+        # lazy filter, issues are streamed from Redmine to the database batch by batch
+        event_issues = filter(lambda i: is_syncable_issue(i) and committed.get(i.id) != i.updated_on, 
+                              all_event_issues)
+        start_dt = last_updated.replace(hour=0, minute=0, second=0, microsecond=0)
+        checkpoint = _checkpoint(run_id)
+        if sync_workers > 1:
+            _, failed = eventsync.redmine_elsa_sync.sync_event_issues_partitioned(
+                event_issues, last_update_dt=last_updated, start_dt=start_dt, bulk=bulk_writes,
+                on_batch_committed=checkpoint, workers=sync_workers)
+        else:
+            eventsync.redmine_elsa_sync.sync_event_issues(event_issues, last_update_dt=last_updated, start_dt=start_dt,
+                                                          bulk=bulk_writes, on_batch_committed=checkpoint)
+            failed = {}
+    except SyncInterrupted:
+        # committed batches are checkpointed, the next run resumes from there
+        logg.info("sync run %s interrupted", run_id)
+        state.finish_run(run_id, status="interrupted")
+        return
+    except Exception as e:
+        state.finish_run(run_id, status="failed", error=str(e))
+        raise
+    if failed:
+        # committed partitions are kept, the next runs resume and retry the failed ones until the run is abandoned
+        state.finish_run(run_id, status="failed", error="failed partitions: {}".format(", ".join(map(str, failed))))
+    else:
+        state.finish_run(run_id)
+    logg.debug("update datetime is %s", state.get_watermark())
     
 
+def do_window_sync(days):
+    """Sync all issues updated in the last `days` days again.
+    Catches changes the incremental sync missed. The watermark isn't touched.
+    """
+    now = datetime.now()
+    window_start = now - timedelta(days=days)
+    logg.info("syncing issues updated since %s", window_start)
+    event_issues = filter(is_syncable_issue, get_event_issues(True, window_start, now, records=True))
+
+    def stop_on_shutdown(batch):
+        if shutdown.is_set():
+            raise SyncInterrupted("shutdown requested")
+    try:
+        # events in the window were modified by our own syncs, that's no reason to warn
+        eventsync.redmine_elsa_sync.sync_event_issues(event_issues, last_update_dt=window_start, bulk=bulk_writes,
+                                                      on_batch_committed=stop_on_shutdown, check_modified=False)
+    except SyncInterrupted:
+        logg.info("window sync interrupted")
+
+
+def instrumented(name, func):
+    """Log a structured summary of the metrics for every run of `func` and export them if configured."""
+    def run(*args):
+        before = metrics.snapshot()
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            summary = metrics.summary_since(before)
+            summary.update(job=name, duration=round(time.perf_counter() - started, 3))
+            logg.info("run summary %s", json.dumps(summary, sort_keys=True))
+            if metrics_filename:
+                metrics.write_prometheus(metrics_filename)
+    return run
+
+
+def run_scheduler(interval):
+    """Run the incremental sync every `interval` seconds and the deep sync, full reconcile and
+    template materialisation configured in runner_settings at their cadences, until SIGINT or SIGTERM.
+    If WEBHOOK_PORT is set, issue change notifications trigger a sync of the notified issues,
+    polling stays active as fallback.
+    """
+    scheduler = SyncScheduler()
+    scheduler.add_job("recent", interval, instrumented("recent", do_sync))
+    deep_interval = getattr(runner_settings, "DEEP_SYNC_INTERVAL", None)
+    if deep_interval:
+        deep_days = getattr(runner_settings, "DEEP_SYNC_DAYS", 7)
+        scheduler.add_job("deep", deep_interval, instrumented("deep", lambda: do_window_sync(deep_days)), 
+                          first_delay=deep_interval)
+    full_interval = getattr(runner_settings, "FULL_SYNC_INTERVAL", None)
+    if full_interval:
+        scheduler.add_job("reconcile", full_interval, instrumented("reconcile", eventsync.redmine_elsa_sync.reconcile),
+                          first_delay=full_interval)
+
+    def stop():
+        shutdown.set()
+        scheduler.stop()
+
+    template_interval = getattr(runner_settings, "TEMPLATE_INTERVAL", None)
+    if template_interval:
+        scheduler.add_job("templates", template_interval, 
+                          instrumented("templates", lambda: materialise_templates(state)))
+    webhook_port = getattr(runner_settings, "WEBHOOK_PORT", None)
+    webhook = None
+    if webhook_port:
+        sync_issues_by_id = instrumented("webhook", eventsync.redmine_elsa_sync.sync_issues_by_id)
+
+        def sync_notified(issue_ids):
+            return scheduler.run_once("webhook", lambda: sync_issues_by_id(issue_ids))
+        webhook = WebhookListener(sync_notified,
+                                  getattr(runner_settings, "WEBHOOK_HOST", "127.0.0.1"), webhook_port,
+                                  getattr(runner_settings, "WEBHOOK_TOKEN", None), metrics=metrics)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop)
+        if webhook is not None:
+            await webhook.start()
+        try:
+            await scheduler.run()
+        finally:
+            if webhook is not None:
+                await webhook.stop()
+
+    try:
+        asyncio.run(main())
+    finally:
+        state.close()
+        logg.info("state saved, exiting")
+
+
 if __name__ == "__main__":
     interval = int(sys.argv[1]) if len(sys.argv) == 2 else 0
     
     if interval > 0:
         # run sync every 'interval' seconds
-        while 1:
-            do_sync()
-            logg.info("sleeping for %s seconds", interval)
-            sleep(interval)
+        run_scheduler(interval)
     else:
         # run it once and exit
-        do_sync()
\ No newline at end of file
+        instrumented("sync", do_sync)()
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+'''
+scripts.sync_issues.py
+
+Sync some Redmine issues to ELSAEvent right away, regardless of their update time.
+Usage: python scripts/sync_issues.py 123 124,125 ...
+'''
+import sys
+
+sys.path.append(".")
+
+import eventsync.logconfig
+import eventsync.redmine_elsa_sync as redmine_elsa_sync
+
+logg = eventsync.logconfig.configure_logging()
+
+issue_ids = [int(i) for arg in sys.argv[1:] for i in arg.split(",") if i]
+if not issue_ids:
+    sys.exit("usage: sync_issues.py ISSUE_ID [ISSUE_ID ...]")
+missing = redmine_elsa_sync.sync_issues_by_id(issue_ids)
+sys.exit(1 if missing else 0)
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+'''
+tests
+
+Offline tests for the sync, run with python -m pytest tests (or python -m unittest discover tests).
+They use SQLite databases in temporary directories and the Redmine stand-in from the benchmarks,
+the usual localsettings modules are needed like for the scripts.
+'''
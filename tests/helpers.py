@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+'''
+tests.helpers.py
+
+ELSAEvent test databases and Redmine issues for the tests.
+'''
+import os
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from eventsync.elsaevent.datamodel import DeclarativeBase, User, Status, Category, Group
+from eventsync.elsaevent.localsettings import ELSA_REDMINE_USERNAME, ELSA_DEFAULT_CATEGORY
+from eventsync.redmine.records import IssueRecord
+
+PROJECT_ID = 100
+GROUP_ID = 1
+
+
+def make_elsa_session(directory):
+    """Session for a new ELSAEvent SQLite database in `directory` with the rows the sync needs.
+    Project PROJECT_ID is mapped to group GROUP_ID.
+    """
+    engine = create_engine("sqlite:///" + os.path.join(directory, "elsa.db"))
+    DeclarativeBase.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(User(id=1, group_id=GROUP_ID, password="x", real_name="Redmine", role="user",
+                     timezone="Europe/Berlin", username=ELSA_REDMINE_USERNAME))
+    for status_id, name in enumerate(["Neu", "Bestätigt", "Abgesagt"], 1):
+        session.add(Status(id=status_id, name=name))
+    session.add(Category(id=1, name=ELSA_DEFAULT_CATEGORY))
+    session.add(Group(id=GROUP_ID, homepage="", kurzalias="g", name="Gruppe", wikipage=""))
+    session.commit()
+    return session
+
+
+def issue(issue_id, subject=None, updated_on="2030-01-01T10:00:00Z", status="Bestätigt", project_id=PROJECT_ID):
+    """Event issue record like it is built from the Redmine API."""
+    return IssueRecord.from_dict({
+        "id": issue_id,
+        "project": {"id": project_id, "name": "Projekt"},
+        "tracker": {"id": 1, "name": "Termin"},
+        "status": {"id": 2, "name": status},
+        "subject": subject or "Termin {}".format(issue_id),
+        "description": "Beschreibung",
+        "start_date": "2030-02-01",
+        "due_date": "2030-02-01",
+        "custom_fields": [{"id": 2, "name": "Startzeit", "value": "19:00"},
+                          {"id": 4, "name": "Veranstaltungsort", "value": "Gaststätte"}],
+        "created_on": "2029-12-01T10:00:00Z",
+        "updated_on": updated_on,
+    })
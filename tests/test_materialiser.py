@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+'''
+tests.test_materialiser.py
+
+Idempotent materialisation of event templates against the Redmine stand-in.
+'''
+from datetime import date, timedelta
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from eventsync.redmine import httpcache
+from eventsync.redmine.metacache import metadata_cache
+from eventsync.redmine.redmineapi import BaseRedmineResource, Issue
+from eventsync.materialiser import materialise_templates, pending_occurrences
+from eventsync.statestore import SyncStateStore
+
+from benchmarks.redmine_standin import RedmineStandIn
+
+TODAY = date(2030, 1, 1)
+
+
+def template(template_id, due_date=None, recurrence="Jede Woche", terminart="Termin"):
+    """Weekly event template starting on TODAY, custom fields given as None are left out."""
+    custom_fields = [dict(id=10, name="Wiederholungsart", value=recurrence),
+                     dict(id=11, name="Terminart", value=terminart),
+                     dict(id=2, name="Startzeit", value="19:00"),
+                     dict(id=4, name="Ort", value="Gaststätte {}".format(template_id))]
+    return Issue(dict(
+        id=template_id, subject="Stammtisch am $datum", description="Um $startzeit in $ort.",
+        project=dict(id=100, name="Projekt"), start_date=TODAY.isoformat(), due_date=due_date,
+        custom_fields=[cf for cf in custom_fields if cf["value"] is not None]))
+
+
+class MaterialiserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.state = SyncStateStore(os.path.join(self.tmpdir.name, "state.sqlite"))
+        self.standin = RedmineStandIn(10).start()
+        self.site = BaseRedmineResource.site
+        self.cache_settings = httpcache.HTTP_CACHE_FILENAME, metadata_cache.filename
+        httpcache.HTTP_CACHE_FILENAME = None
+        metadata_cache.filename = None
+        metadata_cache.invalidate()
+        BaseRedmineResource.site = self.standin.url
+
+    def tearDown(self):
+        BaseRedmineResource.site = self.site
+        httpcache.HTTP_CACHE_FILENAME, metadata_cache.filename = self.cache_settings
+        metadata_cache.invalidate()
+        self.standin.stop()
+        self.state.close()
+        self.tmpdir.cleanup()
+
+    def materialise(self, templates, today=TODAY):
+        return materialise_templates(self.state, templates, horizon_days=28, today=today, rate=None)
+
+    def test_repeated_run_creates_nothing(self):
+        # without due date only the horizon is expanded
+        templates = [template(900), template(901, due_date="2030-01-15")]
+        results = self.materialise(templates)
+        self.assertEqual([r.status for r in results], ["created"] * 8)
+        self.assertEqual(self.materialise(templates), [])
+        self.assertEqual(len(self.standin.created), 8)
+
+    def test_horizon_moves_on(self):
+        templates = [template(900)]
+        self.materialise(templates)
+        results = self.materialise(templates, today=date(2030, 1, 8))
+        self.assertEqual([r.key for r in results], [(900, date(2030, 2, 5))])
+        self.assertEqual(self.standin.created[-1]["subject"], "Stammtisch am 05.02.2030")
+
+    def test_invalid_templates_are_skipped(self):
+        without_recurrence = template(902, recurrence=None)
+        unknown_tracker = template(903, terminart="Termin extern")
+        tracker_id = metadata_cache.tracker_id
+
+        def tracker_id_without_external(name):
+            if name == "Termin extern":
+                raise LookupError("trackers 'Termin extern' doesn't exist in Redmine or is not accessible")
+            return tracker_id(name)
+        templates = [without_recurrence, unknown_tracker, template(904, due_date="2030-01-01")]
+        with mock.patch.object(metadata_cache, "tracker_id", tracker_id_without_external), \
+                self.assertLogs("eventsync.materialiser", "WARNING") as logs:
+            items = pending_occurrences(self.state, templates, TODAY, TODAY + timedelta(days=28))
+        self.assertEqual([key for key, _ in items], [(904, TODAY)])
+        self.assertIn("#902", logs.output[0])
+        self.assertIn("#903", logs.output[1])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+'''
+tests.test_reconcile.py
+
+Full reconcile of the events with the issues of the Redmine stand-in.
+'''
+from datetime import datetime
+import os
+import tempfile
+import unittest
+
+from eventsync.elsaevent.datamodel import Event, Group, categories_events
+from eventsync.fingerprints import FingerprintStore
+from eventsync.redmine import httpcache
+from eventsync.redmine.metacache import metadata_cache
+from eventsync.redmine.redmineapi import BaseRedmineResource
+from eventsync.redmine_elsa_sync import SyncContext, URL_PATTERN, delete_events, load_project_mappings, reconcile, \
+    sync_issues_by_id
+
+from benchmarks.redmine_standin import RedmineStandIn
+from tests.helpers import make_elsa_session, GROUP_ID
+
+OTHER_GROUP_ID = 2
+
+
+class ReconcileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.session = make_elsa_session(self.tmpdir.name)
+        self.session.add(Group(id=OTHER_GROUP_ID, homepage="", kurzalias="g2", name="Gruppe 2", wikipage=""))
+        self.session.commit()
+        self.fingerprints = FingerprintStore(":memory:")
+        # issues 2, 4, 6 are in project 100, issues 1, 3, 5 in project 101
+        self.standin = RedmineStandIn(6, projects=2).start()
+        self.site = BaseRedmineResource.site
+        self.cache_settings = httpcache.HTTP_CACHE_FILENAME, metadata_cache.filename
+        httpcache.HTTP_CACHE_FILENAME = None
+        metadata_cache.filename = None
+        metadata_cache.invalidate()
+        BaseRedmineResource.site = self.standin.url
+
+    def tearDown(self):
+        BaseRedmineResource.site = self.site
+        httpcache.HTTP_CACHE_FILENAME, metadata_cache.filename = self.cache_settings
+        metadata_cache.invalidate()
+        self.standin.stop()
+        self.session.close()
+        self.tmpdir.cleanup()
+
+    def context(self, project_mappings):
+        return SyncContext(self.session, project_mappings, self.fingerprints)
+
+    def events(self):
+        self.session.expire_all()
+        return {event.id: event for event in self.session.query(Event)}
+
+    def add_event(self, url):
+        event = Event(group_id=GROUP_ID, url=url, title="Verwaist", startdate=datetime(2030, 1, 1), status_id=2,
+                      user_id=1, location="unbekannt", timezone="Europe/Berlin", alias="")
+        self.session.add(event)
+        self.session.commit()
+        return event.id
+
+    def test_missing_and_orphaned_events(self):
+        ctx = self.context({100: GROUP_ID, 101: GROUP_ID})
+        sync_issues_by_id([1, 2, 3, 4], ctx)
+        orphans = [self.add_event(URL_PATTERN + "99"), self.add_event(URL_PATTERN + "1"),
+                   self.add_event("http://example.com/termin")]
+        result = reconcile(ctx)
+        self.assertEqual(result.missing, {5, 6})
+        self.assertEqual(result.outdated, set())
+        self.assertEqual(sorted(result.orphans), orphans)
+        events = self.events()
+        self.assertFalse(set(orphans) & events.keys())
+        self.assertEqual(sorted(event.url for event in events.values()),
+                         sorted(URL_PATTERN + str(i) for i in range(1, 7)))
+
+    def test_synced_events_are_not_outdated(self):
+        ctx = self.context({100: GROUP_ID, 101: GROUP_ID})
+        reconcile(ctx)
+        modified = {event.url: event.modified for event in self.events().values()}
+        # the issues were updated after the events were written, but their versions were synced
+        self.assertEqual(reconcile(ctx), (set(), set(), [], set()))
+        # unchanged events are left alone by targeted syncs
+        sync_issues_by_id([1, 2], ctx)
+        self.assertEqual({event.url: event.modified for event in self.events().values()}, modified)
+
+    def test_outdated_event(self):
+        ctx = self.context({100: GROUP_ID, 101: GROUP_ID})
+        reconcile(ctx)
+        # an older version of issue 2 was synced
+        self.fingerprints.update_versions({URL_PATTERN + "2": datetime(2000, 1, 1)})
+        result = reconcile(ctx, dry_run=True)
+        self.assertEqual(result.outdated, {2})
+        reconcile(ctx)
+        self.assertEqual(self.fingerprints.versions()[URL_PATTERN + "2"], datetime(2029, 3, 3, 10))
+
+    def test_events_of_unresolved_projects_are_kept(self):
+        reconcile(self.context({100: GROUP_ID, 101: OTHER_GROUP_ID}))
+        # the project for group 2 couldn't be resolved, its issues are unknown
+        ctx = self.context({100: GROUP_ID})
+        ctx.unresolved_groups.add(OTHER_GROUP_ID)
+        self.assertEqual(reconcile(ctx).orphans, [])
+        self.assertEqual(len(self.events()), 6)
+        # a project which was removed from the mappings deletes its events
+        result = reconcile(self.context({100: GROUP_ID}))
+        self.assertEqual(len(result.orphans), 3)
+        self.assertEqual(sorted(event.url for event in self.events().values()),
+                         [URL_PATTERN + str(i) for i in (2, 4, 6)])
+
+    def test_too_many_orphans_are_not_deleted(self):
+        reconcile(self.context({100: GROUP_ID, 101: GROUP_ID}))
+        result = reconcile(self.context({}))
+        self.assertEqual(len(result.orphans), 6)
+        self.assertEqual(len(self.events()), 6)
+
+    def test_delete_events(self):
+        ctx = self.context({100: GROUP_ID, 101: GROUP_ID})
+        sync_issues_by_id([1, 2], ctx)
+        event_ids = sorted(self.events())
+        delete_events(ctx, event_ids[:1])
+        ctx.commit()
+        self.assertEqual(sorted(self.events()), event_ids[1:])
+        categorised = {row.event_id for row in self.session.execute(categories_events.select())}
+        self.assertEqual(categorised, set(event_ids[1:]))
+
+    def test_unresolved_project_mappings(self):
+        filename = os.path.join(self.tmpdir.name, "mappings")
+        with open(filename, "w") as f:
+            f.write("[projects]\nprojekt0 = Gruppe\ngibtsnicht = Gruppe 2\n")
+        unresolved = set()
+        self.assertEqual(load_project_mappings(self.session, filename, unresolved), {100: GROUP_ID})
+        self.assertEqual(unresolved, {OTHER_GROUP_ID})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+'''
+tests.test_scheduler.py
+
+Cadences and mutual exclusion of scheduled jobs.
+'''
+import asyncio
+import threading
+import time
+import unittest
+
+from eventsync.scheduler import SyncScheduler
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_jobs_dont_overlap(self):
+        scheduler = SyncScheduler()
+        running = []
+        overlaps = []
+        lock = threading.Lock()
+
+        def job():
+            with lock:
+                if running:
+                    overlaps.append(True)
+                running.append(True)
+            time.sleep(0.03)
+            with lock:
+                running.pop()
+        fast = scheduler.add_job("fast", 0.02, job)
+        slow = scheduler.add_job("slow", 0.05, job)
+
+        async def main():
+            asyncio.get_running_loop().call_later(0.4, scheduler.stop)
+            await scheduler.run()
+        asyncio.run(main())
+        self.assertEqual(overlaps, [])
+        self.assertGreater(fast.runs, 1)
+        self.assertGreater(slow.runs, 1)
+        # the fast job can't keep its cadence, missed ticks are skipped instead of queued
+        self.assertGreater(fast.skipped, 0)
+
+    def test_failing_job_keeps_running(self):
+        scheduler = SyncScheduler()
+
+        def fail():
+            raise RuntimeError("Redmine is down")
+        job = scheduler.add_job("failing", 0.02, fail)
+
+        async def main():
+            asyncio.get_running_loop().call_later(0.15, scheduler.stop)
+            await scheduler.run()
+        asyncio.run(main())
+        self.assertGreater(job.failures, 1)
+        self.assertEqual(job.failures, job.runs)
+
+
+if __name__ == "__main__":
+    unittest.main()
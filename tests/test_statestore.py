@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+'''
+tests.test_statestore.py
+
+Watermarks, checkpoints and resuming of sync runs.
+'''
+from datetime import datetime
+import os
+import tempfile
+import unittest
+
+from eventsync.elsaevent.datamodel import Event
+from eventsync.fingerprints import FingerprintStore
+from eventsync.redmine_elsa_sync import SyncContext, SyncStopped, sync_event_issues
+from eventsync.statestore import SyncStateStore, MAX_RUN_FAILURES
+
+from tests.helpers import make_elsa_session, issue, PROJECT_ID, GROUP_ID
+
+WINDOW_START = datetime(2030, 1, 1)
+WINDOW_END = datetime(2030, 1, 2)
+
+
+class StateStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.state = SyncStateStore(os.path.join(self.tmpdir.name, "state.sqlite"))
+
+    def tearDown(self):
+        self.state.close()
+        self.tmpdir.cleanup()
+
+
+class RunTest(StateStoreTestCase):
+
+    def test_successful_run_moves_watermark(self):
+        run_id = self.state.start_run(WINDOW_START, WINDOW_END)
+        self.state.checkpoint(run_id, [issue(1, updated_on="2030-01-01T12:00:00Z")])
+        self.state.finish_run(run_id)
+        self.assertIsNone(self.state.unfinished_run())
+        self.assertIsNotNone(self.state.get_watermark())
+        self.assertEqual(self.state.committed_issues(run_id), {})
+
+    def test_interrupted_run_is_resumed(self):
+        run_id = self.state.start_run(WINDOW_START, WINDOW_END)
+        self.state.checkpoint(run_id, [issue(1, updated_on="2030-01-01T12:00:00Z")])
+        self.state.finish_run(run_id, status="interrupted")
+        for _ in range(MAX_RUN_FAILURES + 1):
+            self.assertEqual(self.state.unfinished_run(), (run_id, WINDOW_START, WINDOW_END))
+        self.assertEqual(self.state.committed_issues(run_id), {1: datetime(2030, 1, 1, 12)})
+        self.assertIsNone(self.state.get_watermark())
+
+    def test_failing_run_is_abandoned(self):
+        run_id = self.state.start_run(WINDOW_START, WINDOW_END)
+        for _ in range(MAX_RUN_FAILURES):
+            self.assertEqual(self.state.unfinished_run(), (run_id, WINDOW_START, WINDOW_END))
+            self.state.finish_run(run_id, status="failed", error="partition 100 failed")
+        self.assertIsNone(self.state.unfinished_run())
+        self.assertEqual(self.state.last_runs()[0]["status"], "abandoned")
+
+
+class ResumeSyncTest(StateStoreTestCase):
+    """Interrupt a sync after its first batch and resume it like the runner does."""
+
+    def setUp(self):
+        super().setUp()
+        self.session = make_elsa_session(self.tmpdir.name)
+        self.ctx = SyncContext(self.session, {PROJECT_ID: GROUP_ID}, FingerprintStore(":memory:"))
+        self.addCleanup(self.session.close)
+
+    def sync(self, run_id, issues, stop=False):
+        committed = self.state.committed_issues(run_id)
+        synced = []
+
+        def checkpoint(batch):
+            self.state.checkpoint(run_id, batch)
+            synced.extend(i.id for i in batch)
+            if stop:
+                raise SyncStopped("shutdown requested")
+        pending = [i for i in issues if committed.get(i.id) != i.updated_on]
+        try:
+            sync_event_issues(pending, WINDOW_START, context=self.ctx, batch_size=2, on_batch_committed=checkpoint)
+        except SyncStopped:
+            self.state.finish_run(run_id, status="interrupted")
+        else:
+            self.state.finish_run(run_id)
+        return synced
+
+    def test_resume_after_interruption(self):
+        issues = [issue(i) for i in range(1, 6)]
+        run_id = self.state.start_run(WINDOW_START, WINDOW_END)
+        self.assertEqual(self.sync(run_id, issues, stop=True), [1, 2])
+        resumed_id, _, _ = self.state.unfinished_run()
+        self.assertEqual(resumed_id, run_id)
+        # the committed batch is skipped
+        self.assertEqual(self.sync(run_id, issues), [3, 4, 5])
+        self.assertIsNone(self.state.unfinished_run())
+        self.assertEqual(self.session.query(Event).count(), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+'''
+tests.test_sync.py
+
+Writing events with sync_event_issues: fingerprint skipping and failed batches.
+'''
+from datetime import datetime
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from eventsync.elsaevent.datamodel import Event
+from eventsync.fingerprints import FingerprintStore
+from eventsync.metrics import metrics
+from eventsync import redmine_elsa_sync
+from eventsync.redmine_elsa_sync import SyncContext, BulkEventWriter, SyncStopped, sync_event_issues, \
+    sync_event_issues_partitioned, URL_PATTERN
+
+from tests.helpers import make_elsa_session, issue, PROJECT_ID, GROUP_ID
+
+LAST_UPDATE = datetime(2000, 1, 1)
+
+
+class SyncTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.session = make_elsa_session(self.tmpdir.name)
+        self.ctx = SyncContext(self.session, {PROJECT_ID: GROUP_ID}, FingerprintStore(":memory:"))
+
+    def tearDown(self):
+        self.session.close()
+        self.tmpdir.cleanup()
+
+    def event(self, issue_id):
+        self.session.expire_all()
+        return self.session.query(Event).filter_by(url=URL_PATTERN + str(issue_id)).one()
+
+
+class FingerprintTest(SyncTestCase):
+
+    def test_unchanged_event_is_skipped(self):
+        sync_event_issues([issue(1)], LAST_UPDATE, context=self.ctx)
+        modified = self.event(1).modified
+        # only updated_on changed, like after adding a journal note
+        sync_event_issues([issue(1, updated_on="2030-01-02T10:00:00Z")], LAST_UPDATE, context=self.ctx)
+        self.assertEqual(self.event(1).modified, modified)
+
+    def test_changed_event_is_rewritten(self):
+        for bulk in (False, True):
+            sync_event_issues([issue(1)], LAST_UPDATE, context=self.ctx, bulk=bulk)
+            sync_event_issues([issue(1, "Neuer Titel {}".format(bulk))], LAST_UPDATE, context=self.ctx, bulk=bulk)
+            self.assertEqual(self.event(1).title, "Neuer Titel {}".format(bulk))
+
+
+class ModifiedCheckTest(SyncTestCase):
+
+    def test_window_sync_doesnt_warn_about_own_writes(self):
+        window_start = datetime.utcnow()
+        sync_event_issues([issue(1)], LAST_UPDATE, context=self.ctx)
+        changed = issue(1, "Neuer Titel", updated_on="2099-01-01T10:00:00Z")
+        with self.assertNoLogs("eventsync.redmine_elsa_sync", "WARNING"):
+            sync_event_issues([changed], window_start, context=self.ctx, check_modified=False)
+        self.assertEqual(self.event(1).title, "Neuer Titel")
+        with self.assertLogs("eventsync.redmine_elsa_sync", "WARNING"):
+            sync_event_issues([changed], window_start, context=self.ctx)
+
+
+class FailedBatchTest(SyncTestCase):
+
+    def test_failed_flush_is_rewritten(self):
+        sync_event_issues([issue(1), issue(2)], LAST_UPDATE, context=self.ctx, bulk=True)
+        changed = issue(1, "Neuer Titel")
+        with mock.patch.object(BulkEventWriter, "_flush_updates", side_effect=RuntimeError("database gone")):
+            with self.assertRaises(RuntimeError):
+                sync_event_issues([changed], LAST_UPDATE, context=self.ctx, bulk=True)
+        # another commit must not store the fingerprint of the failed write
+        sync_event_issues([issue(2)], LAST_UPDATE, context=self.ctx, bulk=True)
+        self.assertEqual(self.event(1).title, "Termin 1")
+        sync_event_issues([changed], LAST_UPDATE, context=self.ctx, bulk=True)
+        self.assertEqual(self.event(1).title, "Neuer Titel")
+
+    def test_failed_threshold_flush_fails_batch(self):
+        with mock.patch.object(redmine_elsa_sync, "BulkEventWriter", lambda ctx: BulkEventWriter(ctx, batch_size=2)), \
+                mock.patch.object(BulkEventWriter, "_flush_inserts", side_effect=RuntimeError("database gone")):
+            with self.assertRaises(RuntimeError):
+                sync_event_issues([issue(i) for i in range(1, 6)], LAST_UPDATE, context=self.ctx, bulk=True)
+        sync_event_issues([issue(i) for i in range(1, 6)], LAST_UPDATE, context=self.ctx, bulk=True)
+        self.assertEqual(self.session.query(Event).count(), 5)
+
+
+class MetricsTest(SyncTestCase):
+
+    def test_writes_are_counted_on_commit(self):
+        for bulk in (False, True):
+            before = metrics.snapshot()
+            for subject, counter in ((None, "events_inserted"), ("Neuer Titel", "events_updated")):
+                issues = [issue(1, subject), issue(2, subject)]
+                # the events are written to the database, but the commit fails
+                with mock.patch.object(self.session, "commit", side_effect=RuntimeError("database gone")):
+                    with self.assertRaises(RuntimeError):
+                        sync_event_issues(issues, LAST_UPDATE, context=self.ctx, bulk=bulk)
+                self.assertNotIn(counter, metrics.summary_since(before)["counters"])
+                sync_event_issues(issues, LAST_UPDATE, context=self.ctx, bulk=bulk)
+                summary = metrics.summary_since(before)
+                self.assertEqual(summary["counters"][counter], 2)
+                self.assertIn("flush", summary["timers"])
+            self.session.query(Event).delete()
+            self.session.commit()
+            self.ctx.fingerprints.clear()
+
+
+class PartitionedSyncTest(SyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.ctx = SyncContext(self.session, {p: GROUP_ID for p in (100, 101, 102)}, FingerprintStore(":memory:"))
+        self.issues = [issue(i, project_id=100 + i % 3) for i in range(1, 10)]
+        new_session = mock.patch.object(redmine_elsa_sync.elsaevent, "new_session", 
+                                        lambda: type(self.session)(bind=self.session.bind))
+        new_session.start()
+        self.addCleanup(new_session.stop)
+
+    def test_partitions(self):
+        _, failed = sync_event_issues_partitioned(self.issues, LAST_UPDATE, context=self.ctx, workers=2)
+        self.assertEqual(failed, {})
+        self.assertEqual(self.session.query(Event).count(), 9)
+
+    def test_stop_cancels_partitions(self):
+        def stop(batch):
+            raise SyncStopped("shutdown requested")
+        with self.assertRaises(SyncStopped):
+            sync_event_issues_partitioned(self.issues, LAST_UPDATE, context=self.ctx, on_batch_committed=stop,
+                                          workers=1)
+        # the first partition was committed, the others didn't start
+        self.assertEqual(self.session.query(Event).count(), 3)
+
+    def test_stop_reaches_running_partitions(self):
+        issues = [issue(i, project_id=100) for i in range(1, 3)] + [issue(i, project_id=101) for i in range(3, 13)]
+        stopping = threading.Event()
+
+        def on_batch_committed(batch):
+            if batch[0].project.id == 100:
+                stopping.set()
+                raise SyncStopped("shutdown requested")
+            # the other partition is in the middle of its issues when the first one stops
+            stopping.wait(5)
+            time.sleep(0.1)
+        with self.assertRaises(SyncStopped):
+            sync_event_issues_partitioned(issues, LAST_UPDATE, context=self.ctx, batch_size=2,
+                                          on_batch_committed=on_batch_committed, workers=2)
+        # one batch of project 101 was committed, then it stopped
+        self.assertEqual(self.session.query(Event).count(), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+'''
+tests.test_templates.py
+
+Expansion of event templates.
+'''
+from datetime import date, datetime
+import unittest
+
+from eventsync.redmine.issues import occurrence_dates
+
+
+class OccurrenceDatesTest(unittest.TestCase):
+
+    def test_only_range_is_expanded(self):
+        # no due date, the recurrence would run until year 9999
+        dates = occurrence_dates("Jede Woche", datetime(2026, 1, 6), None, None, date(2026, 3, 1), date(2026, 3, 31))
+        self.assertEqual(dates, (date(2026, 3, 3), date(2026, 3, 10), date(2026, 3, 17), date(2026, 3, 24), 
+                                 date(2026, 3, 31)))
+
+    def test_due_date_limits_range(self):
+        dates = occurrence_dates("Abstand in Tagen", datetime(2026, 1, 1), datetime(2026, 1, 10), "3", 
+                                 date(2025, 1, 1), date(2027, 1, 1))
+        self.assertEqual(dates, (date(2026, 1, 1), date(2026, 1, 4), date(2026, 1, 7), date(2026, 1, 10)))
+
+    def test_unlimited_recurrence_is_rejected(self):
+        with self.assertRaises(ValueError):
+            occurrence_dates("Jede Woche", datetime(2026, 1, 6), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
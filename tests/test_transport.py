@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+'''
+tests.test_transport.py
+
+Keep-alive connections, retries and conditional requests of the pooled Redmine transport,
+against a small local HTTP server.
+'''
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from pyactiveresource import connection
+
+from eventsync.redmine import httpcache
+from eventsync.redmine.formats import RedmineJSONFormat
+from eventsync.redmine.httpcache import ResponseCache
+from eventsync.redmine.redmineapi import BaseRedmineResource
+from eventsync.redmine.transport import PooledConnection
+
+
+class TestServer(object):
+    """HTTP server with some special paths:
+
+    * /stale.json closes the connection after the response without announcing it
+    * /slow.json answers after 0.5 seconds
+    * other paths answer with JSON
+    """
+    def __init__(self):
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status=200, content=None, headers=None):
+                body = json.dumps(content or {"ok": True}).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def handle_request(self):
+                server.requests.append((self.command, self.path, dict(self.headers)))
+                length = int(self.headers.get("Content-Length", 0))
+                if length:
+                    self.rfile.read(length)
+                if self.path == "/slow.json":
+                    time.sleep(0.5)
+                server.respond(self)
+                if self.path == "/stale.json":
+                    self.close_connection = True
+
+            do_GET = do_POST = handle_request
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        # clients which gave up (timeout tests) aren't errors
+        self._server.handle_error = lambda request, client_address: None
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self._server.server_address[:2])
+
+    def respond(self, handler):
+        handler.send_json()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class TransportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TestServer()
+        self.addCleanup(self.server.stop)
+
+    def connect(self, **kwargs):
+        kwargs.setdefault("retry_backoff", 0)
+        return PooledConnection(self.server.url, format=RedmineJSONFormat, **kwargs)
+
+
+class KeepAliveTest(TransportTestCase):
+
+    def test_connection_is_reused(self):
+        conn = self.connect()
+        for _ in range(3):
+            self.assertEqual(conn.get("/issues.json").code, 200)
+        self.assertEqual(conn._idle.qsize(), 1)
+
+    def test_get_is_sent_again_on_closed_idle_connection(self):
+        conn = self.connect(max_retries=0)
+        conn.get("/stale.json")
+        self.assertEqual(conn.get("/stale.json").code, 200)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_post_is_not_sent_again(self):
+        conn = self.connect(max_retries=0)
+        conn.get("/stale.json")
+        with self.assertRaises(connection.Error):
+            conn.post("/issues.json", data=b'{"issue": {}}')
+        self.assertEqual([r[0] for r in self.server.requests], ["GET"])
+
+    def test_timeout_is_not_sent_again(self):
+        conn = self.connect(timeout=0.2, max_retries=0)
+        conn.get("/issues.json")
+        with self.assertRaises(connection.Error):
+            conn.get("/slow.json")
+        self.assertEqual([r[1] for r in self.server.requests], ["/issues.json", "/slow.json"])
+
+
+class RetryTest(TransportTestCase):
+
+    def fail_first(self, count, status, headers=None):
+        def respond(handler):
+            if len(self.server.requests) <= count:
+                handler.send_json(status, {"errors": ["busy"]}, headers)
+            else:
+                handler.send_json()
+        self.server.respond = respond
+
+    def test_backoff(self):
+        self.fail_first(2, 503)
+        with mock.patch("eventsync.redmine.transport.sleep") as sleep:
+            self.assertEqual(self.connect(retry_backoff=0.5).get("/issues.json").code, 200)
+        self.assertEqual([c.args[0] for c in sleep.call_args_list], [0.5, 1.0])
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_gives_up(self):
+        self.fail_first(10, 503)
+        with mock.patch("eventsync.redmine.transport.sleep"):
+            with self.assertRaises(connection.ServerError):
+                self.connect(max_retries=2).get("/issues.json")
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_post_only_on_429(self):
+        self.fail_first(1, 429, {"Retry-After": "2"})
+        with mock.patch("eventsync.redmine.transport.sleep") as sleep:
+            self.connect().post("/issues.json", data=b'{"issue": {}}')
+        sleep.assert_called_once_with(2)
+        self.server.requests.clear()
+        self.fail_first(1, 503)
+        with self.assertRaises(connection.ServerError):
+            self.connect().post("/issues.json", data=b'{"issue": {}}')
+        self.assertEqual(len(self.server.requests), 1)
+
+
+class ConditionalRequestTest(TransportTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        def respond(handler):
+            if handler.headers.get("If-None-Match") == '"v1"':
+                handler.send_response(304)
+                handler.end_headers()
+            else:
+                handler.send_json(200, {"issues": [1, 2]}, {"ETag": '"v1"'})
+        self.server.respond = respond
+
+    def test_not_modified_is_served_from_cache(self):
+        conn = self.connect(response_cache=ResponseCache(":memory:"))
+        first = conn.get("/issues.json")
+        second = conn.get("/issues.json")
+        self.assertEqual(second.code, 200)
+        self.assertEqual(json.loads(second.body), {"issues": [1, 2]})
+        self.assertEqual(second.body, first.body)
+        self.assertNotIn("If-None-Match", self.server.requests[0][2])
+        self.assertEqual(self.server.requests[1][2]["If-None-Match"], '"v1"')
+
+    def test_without_cache(self):
+        conn = self.connect()
+        conn.get("/issues.json")
+        conn.get("/issues.json")
+        self.assertNotIn("If-None-Match", self.server.requests[1][2])
+
+    def test_cache_filename_setting(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "httpcache")
+            with mock.patch.object(httpcache, "HTTP_CACHE_FILENAME", filename):
+                class Resource(BaseRedmineResource):
+                    pass
+                Resource.site = self.server.url
+                self.assertEqual(Resource.connection.response_cache.filename, filename)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+'''
+tests.test_webhook.py
+
+Parsing and debouncing of issue change notifications.
+'''
+import asyncio
+import json
+import unittest
+
+from eventsync.webhook import parse_issue_ids, WebhookListener
+
+
+class ParseIssueIdsTest(unittest.TestCase):
+
+    def test_plugin_payload(self):
+        body = json.dumps({"payload": {"action": "updated", "issue": {"id": 123, "subject": "Termin"}}})
+        self.assertEqual(parse_issue_ids("/", body.encode("utf-8")), {123})
+
+    def test_pings_and_query_string(self):
+        body = json.dumps({"issue_id": 1, "issue_ids": [2, "3"]}).encode("utf-8")
+        self.assertEqual(parse_issue_ids("/?issue_id=4,5&token=x", body), {1, 2, 3, 4, 5})
+        self.assertEqual(parse_issue_ids("/?issue_id=6", b""), {6})
+
+    def test_malformed(self):
+        for path, body in [("/", b"[1, 2]"), ("/", b"{not json"), ("/?issue_id=abc", b""),
+                           ("/", b'{"issue_ids": ["x"]}')]:
+            with self.assertRaises(ValueError):
+                parse_issue_ids(path, body)
+
+
+class DebounceTest(unittest.TestCase):
+
+    def test_notifications_are_collected(self):
+        calls = []
+
+        async def on_issues(issue_ids):
+            calls.append(issue_ids)
+
+        async def main():
+            listener = WebhookListener(on_issues, debounce=0.05, max_delay=1)
+            listener.notify({1, 2})
+            listener.notify({2, 3})
+            await asyncio.sleep(0.2)
+            listener.notify({4})
+            await asyncio.sleep(0.2)
+            await listener.stop()
+        asyncio.run(main())
+        self.assertEqual(calls, [{1, 2, 3}, {4}])
+
+    def test_max_delay(self):
+        calls = []
+
+        async def on_issues(issue_ids):
+            calls.append(issue_ids)
+
+        async def main():
+            listener = WebhookListener(on_issues, debounce=0.1, max_delay=0.25)
+            for issue_id in range(6):
+                listener.notify({issue_id})
+                await asyncio.sleep(0.06)
+            await asyncio.sleep(0.3)
+            await listener.stop()
+        asyncio.run(main())
+        self.assertGreater(len(calls), 1)
+        self.assertEqual(set().union(*calls), set(range(6)))
+
+
+if __name__ == "__main__":
+    unittest.main()